@@ -0,0 +1,106 @@
+"""Import time the add-on adds to Orange's startup.
+
+The canvas imports every add-on's widget modules (and with them the readers
+they register) when it starts. This imports, with `python -X importtime`
+in a fresh interpreter, the parts of Orange the canvas has loaded by then,
+and then the add-on's widget modules, as widget discovery does; what is
+imported after Orange is the add-on's cost. It is reported as the
+`orangecontrib` namespace package, which is shared with other add-ons and
+only imported by the first of them, and the add-on's own modules, which
+must stay under `--budget` milliseconds.
+
+The Living Optics SDK must not be imported at startup; for comparison, the
+time it takes to import on first use is shown too (if it is installed).
+
+    python -m benchmarks.bench_import --repeat 5 --budget 50
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+
+MARKER = "-- add-on --"
+SDK_MARKER = "-- sdk --"
+
+CHILD = f"""
+import importlib, pkgutil, sys
+import Orange.canvas.__main__, Orange.data, Orange.widgets.widget
+print({MARKER!r}, file=sys.stderr)
+import orangecontrib.lo.widgets as widgets
+for module in pkgutil.iter_modules(widgets.__path__):
+    importlib.import_module(widgets.__name__ + "." + module.name)
+print("sdk imported" if "lo.sdk" in sys.modules else "sdk deferred")
+print({SDK_MARKER!r}, file=sys.stderr)
+try:
+    import lo.sdk.api.acquisition.io.open
+except ImportError:
+    print("sdk missing")
+"""
+
+
+def _top_level(lines):
+    """(name, cumulative microseconds) of imports made at the top level"""
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+            yield name.strip(), int(cumulative)
+
+
+def _nested(lines, wanted):
+    """Cumulative microseconds of the import of `wanted`, at any depth"""
+    for line in lines:
+        if line.startswith("import time:") and line.split("|")[-1].strip() == wanted:
+            return int(line.split("|")[1])
+    return 0
+
+
+def import_times():
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD],
+                            capture_output=True, text=True, env=env, check=False)
+    if result.returncode:
+        raise RuntimeError(f"Importing the add-on failed:\n{result.stderr}")
+    stderr = result.stderr.splitlines()
+    addon = stderr[stderr.index(MARKER) + 1:stderr.index(SDK_MARKER)]
+    sdk = stderr[stderr.index(SDK_MARKER) + 1:]
+    namespace = _nested(addon, "orangecontrib")
+    return {"namespace": namespace / 1e6,
+            "addon": (sum(t for _, t in _top_level(addon)) - namespace) / 1e6,
+            "sdk": None if "sdk missing" in result.stdout
+                   else sum(t for _, t in _top_level(sdk)) / 1e6,
+            "sdk_at_startup": "sdk imported" in result.stdout}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=50,
+                        help="milliseconds allowed for the add-on's own modules")
+    args = parser.parse_args(argv)
+
+    runs = [import_times() for _ in range(args.repeat)]
+    best = {key: min(run[key] for run in runs) if runs[0][key] is not None else None
+            for key in ("namespace", "addon", "sdk")}
+    rows = [("orangecontrib namespace package", best["namespace"]),
+            ("add-on modules (orangecontrib.lo)", best["addon"]),
+            ("SDK, on first use", best["sdk"])]
+    print(f"{'import':<34}  {'time [ms]':>13}")
+    for name, seconds in rows:
+        print(f"{name:<34}  {'not installed' if seconds is None else f'{1000 * seconds:.1f}':>13}")
+
+    failed = False
+    if any(run["sdk_at_startup"] for run in runs):
+        print("The SDK was imported at startup", file=sys.stderr)
+        failed = True
+    if 1000 * best["addon"] > args.budget:
+        print(f"The add-on's modules took {1000 * best['addon']:.1f} ms "
+              f"to import; the budget is {args.budget:g} ms", file=sys.stderr)
+        failed = True
+    sys.exit(int(failed))
+
+
+if __name__ == "__main__":
+    main()
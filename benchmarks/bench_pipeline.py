@@ -0,0 +1,222 @@
+"""Time and memory of the .lo ingest -> upsample -> index pipeline.
+
+The add-on reads a synthetic capture through a stand-in for the SDK (see
+`sdk_standin`), so no camera data or SDK is needed. Every case runs in a
+fresh interpreter, so that its peak RSS is its own; "RSS setup" is the peak
+before the timed step started (imports, and reading its input). Upsampling
+and indices are timed for frames after the first, with the pixel map cached.
+The viewer cases time a redraw of LOImageViewer, over the frame's preview,
+after colouring by another band or panning a zoomed-in view.
+
+    python -m benchmarks.bench_pipeline --frames 20 --samples 4384 --bands 96
+    python -m benchmarks.bench_pipeline --cases read upsample-640
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from . import sdk_standin
+from .harness import Measurement, measure, peak_rss, report, run_isolated
+
+
+DIMENSIONS = (480, 640, 960, 1920)
+
+
+def _reader(path):
+    from orangecontrib.lo.io.lo import LOReader
+    return LOReader(path)
+
+
+def _widget(cls):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from AnyQt.QtWidgets import QApplication
+    _widget.app = QApplication.instance() or QApplication([])
+    return cls()
+
+
+def sheets_cold(path):
+    from orangecontrib.lo.io import index
+
+    def run():
+        index._indices.clear()
+        try:
+            os.remove(index._index_path(os.path.abspath(path)))
+        except OSError:
+            pass
+        return _reader(path).sheets
+    return run
+
+
+def sheets_cached(path):
+    _reader(path).sheets  # pylint: disable=expression-not-assigned
+    return lambda: _reader(path).sheets
+
+
+def read(path):
+    reader = _reader(path)
+    reader.sheet = reader.sheets[0]
+    return reader.read
+
+
+def read_sampled(path):
+    # A random 5% of the samples
+    reader = _reader(path)
+    reader.sheet = reader.sheets[0]
+    reader.sample_fraction = 0.05
+    return reader.read
+
+
+def stack(path):
+    from orangecontrib.lo.io import stack_frames
+    return lambda: stack_frames(path, processes=0)
+
+
+def stack_reduced(path):
+    # Two wavelength windows, bands averaged in fours
+    from orangecontrib.lo.compute.bands import BandReduction
+    from orangecontrib.lo.io import stack_frames
+    reduction = BandReduction([(450, 700), (780, 900)], 4)
+    return lambda: stack_frames(path, processes=0, reduction=reduction)
+
+
+def aggregate(path):
+    # Mean, spread and median per sample; memory should stay at about a frame
+    from orangecontrib.lo.io import aggregate_frames
+    return lambda: aggregate_frames(path, ("mean", "std", "median"), processes=0)
+
+
+def create_tables(path):
+    from orangecontrib.lo.io.cache import read_frame
+    from orangecontrib.lo.widgets.owlofilereader import OWLOFileReader
+    frame = read_frame(path, 0)
+    return lambda: OWLOFileReader.create_tables_from_results(frame)
+
+
+def upsample(dimension):
+    def case(path):
+        from orangecontrib.lo.widgets.upsamplelo import UpsampleLO
+        data = read(path)()
+        widget = _widget(UpsampleLO)
+        widget.upsample_dimension = str(dimension)
+        widget.set_data(data)
+        return lambda: widget.set_data(data)
+    return case
+
+
+def ndvi(path):
+    # All frames, with the band ratio and every standard index
+    from orangecontrib.lo.io import stack_frames
+    from orangecontrib.lo.widgets.ndvi import NDVI
+    data = stack_frames(path, processes=0)
+    widget = _widget(NDVI)
+    widget.selected_indices = list(range(len(widget.index_names)))
+    return lambda: widget.set_data(data)
+
+
+def _viewer(path):
+    # The viewer showing the first frame over its preview
+    from orangecontrib.lo.io.cache import read_frame
+    from orangecontrib.lo.io.tables import preview_table
+    from orangecontrib.lo.widgets.loimageviewer import LOImageViewer
+    data = read(path)()
+    widget = _widget(LOImageViewer)
+    widget.set_data(data)
+    widget.set_scene(preview_table(read_frame(path, 0)[1]))
+    return data, widget
+
+
+def viewer_band(path):
+    # Colouring the samples by the next band, including the redraw
+    from itertools import cycle
+    data, widget = _viewer(path)
+    widget.plot_widget.grab()
+    bands = cycle(var.name for var in data.domain.attributes)
+
+    def run():
+        widget.colour_by = next(bands)
+        widget.commit()
+        widget.plot_widget.grab()
+    return run
+
+
+def viewer_pan(path):
+    # Panning a view zoomed in far enough to draw the samples as markers
+    from itertools import cycle
+    from AnyQt.QtCore import QRectF
+    data, widget = _viewer(path)
+    x, y, width, height = widget.raster.extent
+    side = width * (widget.MAX_POINTS / 2 / len(data)) ** 0.5
+    offsets = cycle(range(10))
+
+    def run():
+        offset = next(offsets) * side / 10
+        widget.plot_widget.getViewBox().setRange(
+            QRectF(x + width / 2 + offset, y + height / 2, side, side), padding=0)
+        widget.update_points()
+        widget.plot_widget.grab()
+    return run
+
+
+CASES = {
+    "sheets-cold": sheets_cold,
+    "sheets-cached": sheets_cached,
+    "read": read,
+    "read-5pct": read_sampled,
+    "create-tables": create_tables,
+    "stack": stack,
+    "stack-reduced": stack_reduced,
+    "aggregate": aggregate,
+    **{f"upsample-{dimension}": upsample(dimension) for dimension in DIMENSIONS},
+    "ndvi": ndvi,
+    "viewer-band": viewer_band,
+    "viewer-pan": viewer_pan,
+}
+
+
+def run_case(args):
+    sdk_standin.install()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = sdk_standin.write_capture(
+            os.path.join(tmp, "capture.lo"), args.frames, args.samples, args.bands,
+            tuple(args.scene))
+        func = CASES[args.case](path)
+        rss_setup = peak_rss()
+        m = measure(args.case, func, args.repeat)
+        # Don't leave the capture's frame index in Orange's cache directory
+        index = sys.modules.get("orangecontrib.lo.io.index")
+        if index is not None and os.path.exists(index._index_path(path)):
+            os.remove(index._index_path(path))
+    print(json.dumps({"name": m.name, "seconds": m.seconds, "peak_bytes": m.peak_bytes,
+                      "rss_setup": rss_setup, "peak_rss": peak_rss()}))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--samples", type=int, default=4384)
+    parser.add_argument("--bands", type=int, default=96)
+    parser.add_argument("--scene", type=int, nargs=2, default=[2048, 2432],
+                        metavar=("HEIGHT", "WIDTH"))
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--case", choices=list(CASES), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        run_case(args)
+        return
+
+    common = ["--frames", str(args.frames), "--samples", str(args.samples),
+              "--bands", str(args.bands), "--scene", *map(str, args.scene),
+              "--repeat", str(args.repeat)]
+    measurements = []
+    for case in args.cases:
+        result = run_isolated(__spec__.name, common + ["--case", case])
+        measurements.append(Measurement(**result))
+    report(measurements)
+
+
+if __name__ == "__main__":
+    main()
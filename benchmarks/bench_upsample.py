@@ -0,0 +1,60 @@
+"""Time and memory of each upsampling engine, per output size.
+
+For every engine and size, "map" is the first frame of a sampling pattern
+(building the pixel map) and "apply" a later frame with the same pattern;
+"tiled" is `upsample_tiled` with --tile, which builds no cached map.
+
+    python -m benchmarks.bench_upsample --samples 20000 --bands 96 --sizes 480 960
+"""
+import argparse
+
+from orangecontrib.lo.compute.upsample import (
+    UPSAMPLERS, _maps, upsample_frame, upsample_tiled, upsampling_map)
+
+from .harness import measure, report, sampling_coordinates, spectra
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--bands", type=int, default=96)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[480, 640, 960, 1920])
+    parser.add_argument("--engines", nargs="+", default=list(UPSAMPLERS))
+    parser.add_argument("--tile", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    origin, full_size = (64, 256), 1920
+    coordinates = sampling_coordinates(args.samples, origin, full_size)
+    cube = spectra(args.samples, args.bands)
+
+    def build_map(engine, size):
+        _maps.clear()
+        upsampling_map(coordinates, (size, size), origin, size / full_size, engine)
+
+    def apply(engine, size):
+        upsample_frame(cube, coordinates, (size, size), origin,
+                       size / full_size, engine).expand()
+
+    def tiled(engine, size):
+        upsample_tiled(cube, coordinates, (size, size), origin,
+                       size / full_size, engine, tile_size=args.tile)
+
+    measurements = []
+    for engine in args.engines:
+        for size in args.sizes:
+            measurements.append(measure(
+                f"{engine} {size}x{size} map",
+                lambda: build_map(engine, size), args.repeat))
+            build_map(engine, size)
+            measurements.append(measure(
+                f"{engine} {size}x{size} apply",
+                lambda: apply(engine, size), args.repeat))
+            measurements.append(measure(
+                f"{engine} {size}x{size} tiled",
+                lambda: tiled(engine, size), args.repeat))
+    report(measurements)
+
+
+if __name__ == "__main__":
+    main()
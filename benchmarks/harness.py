@@ -0,0 +1,89 @@
+"""Helpers shared by the benchmark scripts.
+
+Each measurement reports the best wall time over a few runs and the peak
+memory allocated during one more, traced, run. NumPy and SciPy report their
+array allocations to `tracemalloc`, so the peak covers the arrays a step
+creates, not memory that was already allocated before it started.
+
+The resident set size, which also covers memory NumPy doesn't trace (the
+SDK's buffers, Qt, memory maps), only has a per-process high-water mark;
+`run_isolated` therefore runs a benchmark in a fresh interpreter and
+reports its peak RSS.
+"""
+import gc
+import json
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+
+import numpy as np
+
+
+# RSS figures are given only for benchmarks run by `run_isolated`
+Measurement = namedtuple("Measurement",
+                         ["name", "seconds", "peak_bytes", "rss_setup", "peak_rss"],
+                         defaults=(None, None))
+
+
+def measure(name, func, repeat=3) -> Measurement:
+    seconds = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return Measurement(name, seconds, peak)
+
+
+def report(measurements):
+    width = max(len(m.name) for m in measurements)
+    rss = any(m.peak_rss is not None for m in measurements)
+    header = f"{'benchmark':<{width}}  {'time [ms]':>10}  {'peak [MB]':>10}"
+    if rss:
+        header += f"  {'RSS setup [MB]':>14}  {'peak RSS [MB]':>13}"
+    print(header)
+    for m in measurements:
+        line = f"{m.name:<{width}}  {1000 * m.seconds:>10.1f}  {m.peak_bytes / 2 ** 20:>10.1f}"
+        if rss:
+            line += f"  {(m.rss_setup or 0) / 2 ** 20:>14.1f}  {(m.peak_rss or 0) / 2 ** 20:>13.1f}"
+        print(line)
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process so far, in bytes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_isolated(module, argv) -> dict:
+    """Run `python -m module *argv` and return the JSON it prints last"""
+    result = subprocess.run([sys.executable, "-m", module] + list(argv),
+                            capture_output=True, text=True, check=False)
+    if result.returncode:
+        raise RuntimeError(f"{module} {' '.join(argv)} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def sampling_coordinates(n_samples, origin=(64, 256), size=1920, seed=0):
+    """A jittered grid of `n_samples` points covering a square field of view"""
+    rng = np.random.default_rng(seed)
+    side = int(np.ceil(np.sqrt(n_samples)))
+    step = size / side
+    grid = np.indices((side, side)).reshape(2, -1).T[:n_samples]
+    jitter = rng.uniform(0, step, (n_samples, 2))
+    return (np.asarray(origin) + grid * step + jitter).astype(np.float32)
+
+
+def spectra(n_samples, n_bands, seed=0):
+    return np.random.default_rng(seed).random((n_samples, n_bands), dtype=np.float32)
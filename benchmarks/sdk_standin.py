@@ -0,0 +1,98 @@
+"""A synthetic stand-in for the Living Optics SDK's .lo reader.
+
+`install()` puts a module `lo.sdk.api.acquisition.io.open` into
+`sys.modules`, so that the add-on reads "captures" written by
+`write_capture`. These are small JSON files describing the frames: their
+number, samples, bands and preview size. Every frame has the same spectra
+and scene (generated once per capture) but is returned in freshly allocated
+arrays, as the SDK decodes each frame into new buffers; benchmarks thus
+measure the add-on rather than the generator.
+
+Only what the add-on uses is provided: `open()` returning a context
+manager with `len()`, `seek(frame)`, `read()` and iteration. The stand-in
+exists only in the process that installs it, so frames must be decoded in
+that process (``processes=0``).
+"""
+import builtins
+import json
+import sys
+import types
+from functools import lru_cache
+
+import numpy as np
+
+from .harness import sampling_coordinates
+
+
+def write_capture(path, frames=20, samples=4384, bands=96, scene_shape=(2048, 2432), seed=0):
+    with builtins.open(path, "w", encoding="utf-8") as f:
+        json.dump({"frames": frames, "samples": samples, "bands": bands,
+                   "scene_shape": list(scene_shape), "seed": seed}, f)
+    return path
+
+
+class Metadata:
+    def __init__(self, frame, wavelengths, coordinates):
+        self.wavelengths = wavelengths
+        self.sampling_coordinates = coordinates
+        self.timestamp_s = 1700000000 + frame // 30
+        self.timestamp_us = frame % 30 * 33333
+
+
+@lru_cache(maxsize=4)
+def _capture(path):
+    with builtins.open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    rng = np.random.default_rng(spec["seed"])
+    wavelengths = np.linspace(440, 900, spec["bands"])
+    coordinates = sampling_coordinates(spec["samples"], seed=spec["seed"])
+    spectra = rng.random((spec["samples"], spec["bands"]), dtype=np.float32)
+    scene = rng.integers(0, 4096, spec["scene_shape"], dtype=np.uint16)
+    return spec["frames"], wavelengths, coordinates, spectra, scene
+
+
+class LOFile:
+    def __init__(self, path):
+        self.n_frames, self.wavelengths, self.coordinates, self.spectra, self.scene = \
+            _capture(path)
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+    def __len__(self):
+        return self.n_frames
+
+    def seek(self, position):
+        self.position = position
+
+    def read(self):
+        if self.position >= self.n_frames:
+            raise EOFError
+        frame, self.position = self.position, self.position + 1
+        metadata = Metadata(frame, self.wavelengths.copy(), self.coordinates.copy())
+        return metadata, self.scene.copy(), self.spectra.copy()
+
+    def __iter__(self):
+        while self.position < self.n_frames:
+            yield self.read()
+
+
+def lo_open(path, *_, **__):
+    return LOFile(path)
+
+
+def install():
+    """Make `import lo.sdk.api.acquisition.io.open` import this stand-in"""
+    names = ["lo", "lo.sdk", "lo.sdk.api", "lo.sdk.api.acquisition",
+             "lo.sdk.api.acquisition.io", "lo.sdk.api.acquisition.io.open"]
+    for parent, name in zip([None] + names, names):
+        module = types.ModuleType(name)
+        module.__path__ = []
+        sys.modules[name] = module
+        if parent is not None:
+            setattr(sys.modules[parent], name.rsplit(".", 1)[1], module)
+    sys.modules["lo.sdk.api.acquisition.io.open"].open = lo_open
@@ -1,3 +1,2 @@
 # namespace declaration
 __import__("pkg_resources").declare_namespace(__name__)
-from .lo.io.lo import LOReader
\ No newline at end of file
@@ -1,2 +1,15 @@
-from . import io
-from .io.lo import LOReader
\ No newline at end of file
+# `io` and `LOReader` need Orange (and, to read .lo files, the Living Optics
+# SDK); they are imported on first use, so that `orangecontrib.lo.compute` can
+# be used without either. Importing `io` registers the readers with Orange, so
+# that Table("capture.lo") works: the widgets import it, and scripts must
+# import `orangecontrib.lo.io` themselves. The SDK is only imported when a
+# file is opened.
+
+def __getattr__(name):
+    if name == "io":
+        from . import io
+        return io
+    if name == "LOReader":
+        from .io.lo import LOReader
+        return LOReader
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,13 @@
+"""Numerical routines behind the Living Optics widgets.
+
+This package uses only NumPy and SciPy: it imports neither Orange, Qt nor
+the Living Optics SDK, so it loads quickly and can be used in batch jobs and
+worker processes. The widgets and `orangecontrib.lo.io` wrap it.
+"""
+from .aggregate import STATISTICS, FrameStatistics
+from .bands import BandReduction, SpectralAxis, parse_windows
+from .image import preview_array
+from .indices import BANDS, INDICES, Formula, IndexEngine, band_ratio, parse_formulas
+from .overlay import PointRaster, colour_levels, points_in
+from .spectra import SampleSelection, empty_spectra, parse_box, spectra_array, stack_spectra
+from .upsample import UPSAMPLERS, UpsampledFrame, upsample_frame, upsample_tiled
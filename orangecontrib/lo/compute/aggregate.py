@@ -0,0 +1,162 @@
+"""Statistics of spectra over the frames of a capture, per sampling point.
+
+A sensor samples the same points in every frame, so row i of each frame's
+spectra is the same point. `FrameStatistics` takes frames one at a time and
+keeps running statistics of each (point, band) value: the mean and variance
+by Welford's method, minimum and maximum, and the median estimated with the
+P² algorithm (Jain & Chlamtac, 1985), which keeps five markers per value
+instead of all the values seen. Memory thus depends on the size of a frame,
+not on the number of frames.
+"""
+from typing import Sequence
+
+import numpy as np
+
+from ..instrument import stage
+
+
+STATISTICS = ("mean", "median", "std", "var", "min", "max")
+
+
+class _P2Quantile:
+    """P² estimates of the `p`-quantile of each element of a stream of arrays.
+
+    Each element has five markers: heights `q` (the minimum, the estimated
+    p/2, p and (1 + p)/2 quantiles, and the maximum) and positions. The
+    outer positions are 1 and the count, the same for all elements, so only
+    the inner three are stored. The first five arrays are kept and sorted
+    into the initial markers.
+    """
+    # Elements are updated in blocks of this many, which stay in the CPU's
+    # cache through the dozens of array operations of an update
+    BLOCK = 1 << 16
+
+    def __init__(self, p: float = 0.5):
+        self.p = p
+        self.n = 0
+        self.q = None  # (5 x elements) marker heights
+        self.positions = None  # (3 x elements) positions of the inner markers
+        self._increments = np.array([0, p / 2, p, (1 + p) / 2, 1])
+
+    def add(self, x: np.ndarray):
+        x = x.ravel()
+        self.n += 1
+        if self.n <= 5:
+            if self.q is None:
+                self.q = np.empty((5, len(x)), dtype=np.float32)
+            self.q[self.n - 1] = x
+            if self.n == 5:
+                self.q.sort(axis=0)
+                self.positions = np.tile(np.array([[2], [3], [4]], dtype=np.float32), len(x))
+            return
+        for first in range(0, len(x), self.BLOCK):
+            block = slice(first, first + self.BLOCK)
+            self._update(x[block], self.q[:, block], self.positions[:, block])
+
+    def _update(self, x, q, positions):
+        np.minimum(q[0], x, out=q[0])
+        np.maximum(q[4], x, out=q[4])
+        # The cell x falls in; the markers above it move up by one
+        k = (x >= q[1]).astype(np.int8)
+        k += x >= q[2]
+        k += x >= q[3]
+        for i in range(3):
+            positions[i] += k <= i
+
+        desired = 1 + (self.n - 1) * self._increments
+        for i in (1, 2, 3):
+            n_i = positions[i - 1]
+            n_below = positions[i - 2] if i > 1 else 1
+            n_above = positions[i] if i < 3 else self.n
+            d = desired[i] - n_i
+            move = np.flatnonzero(((d >= 1) & (n_above - n_i > 1))
+                                  | ((d <= -1) & (n_below - n_i < -1)))
+            if not len(move):
+                continue
+            d = np.sign(d[move])
+            n_i, q_i = n_i[move], q[i, move]
+            q_below, q_above = q[i - 1, move], q[i + 1, move]
+            n_below = n_below[move] if i > 1 else 1
+            n_above = n_above[move] if i < 3 else self.n
+            # Piecewise-parabolic prediction, or linear if that leaves the bracket
+            parabolic = q_i + d / (n_above - n_below) * (
+                (n_i - n_below + d) * (q_above - q_i) / (n_above - n_i)
+                + (n_above - n_i - d) * (q_i - q_below) / (n_i - n_below))
+            linear = np.where(d > 0,
+                              q_i + (q_above - q_i) / (n_above - n_i),
+                              q_i - (q_below - q_i) / (n_below - n_i))
+            q[i, move] = np.where((q_below < parabolic) & (parabolic < q_above),
+                                  parabolic, linear)
+            positions[i - 1, move] += d
+
+    def result(self) -> np.ndarray:
+        if self.n == 0:
+            raise ValueError("No values")
+        if self.n < 5:
+            return np.quantile(self.q[:self.n], self.p, axis=0).astype(np.float32)
+        return self.q[2].copy()
+
+
+class FrameStatistics:
+    """Running statistics of spectra, per sampling point and band, over frames.
+
+    `add` takes the (samples x bands) spectra of one frame at a time; all
+    frames must have the same samples, in the same order. Only the
+    accumulators the requested `statistics` need are kept: two float64
+    arrays the size of a frame for mean, std and var; one float32 array for
+    each of min and max; and eight for the median. The standard deviation
+    and variance are those of the frames seen (ddof=0, as in NumPy).
+    """
+    def __init__(self, statistics: Sequence[str] = ("mean",)):
+        unknown = set(statistics) - set(STATISTICS)
+        if unknown:
+            raise ValueError(f"Unknown statistic(s): {', '.join(sorted(unknown))}")
+        self.statistics = tuple(statistics)
+        self.n = 0
+        self.shape = None
+        self._mean = self._m2 = self._min = self._max = None
+        self._median = _P2Quantile(0.5) if "median" in statistics else None
+
+    def add(self, spectra: np.ndarray):
+        spectra = np.asarray(spectra)
+        if self.shape is None:
+            self.shape = spectra.shape
+        elif spectra.shape != self.shape:
+            raise ValueError("Frames have different samples or wavelengths")
+        self.n += 1
+        with stage("aggregate.add", shape=spectra.shape):
+            if {"mean", "std", "var"} & set(self.statistics):
+                if self._mean is None:
+                    self._mean = spectra.astype(np.float64)
+                    self._m2 = np.zeros(self.shape)
+                else:
+                    delta = spectra - self._mean
+                    self._mean += delta / self.n
+                    delta *= spectra - self._mean
+                    self._m2 += delta
+            if "min" in self.statistics:
+                self._min = spectra.astype(np.float32) if self._min is None \
+                    else np.fmin(self._min, spectra, out=self._min)
+            if "max" in self.statistics:
+                self._max = spectra.astype(np.float32) if self._max is None \
+                    else np.fmax(self._max, spectra, out=self._max)
+            if self._median is not None:
+                self._median.add(spectra)
+
+    def result(self, statistic: str) -> np.ndarray:
+        """The (samples x bands) float32 values of one of the statistics"""
+        if statistic not in self.statistics:
+            raise ValueError(f"{statistic} was not computed")
+        if self.n == 0:
+            raise ValueError("No frames")
+        if statistic == "mean":
+            return self._mean.astype(np.float32)
+        if statistic == "var":
+            return (self._m2 / self.n).astype(np.float32)
+        if statistic == "std":
+            return np.sqrt(self._m2 / self.n).astype(np.float32)
+        if statistic == "min":
+            return self._min.copy()
+        if statistic == "max":
+            return self._max.copy()
+        return self._median.result().reshape(self.shape)
@@ -0,0 +1,159 @@
+"""Wavelength windows of spectra, resolved to columns once.
+
+A `SpectralAxis` holds the wavelengths of a spectra table and turns a band
+window (start, end in nm) into the columns it covers: a slice when they are
+contiguous, as they are for the ascending wavelengths of .lo files, and an
+index array otherwise. Windows are resolved once per axis, so computing a
+band mean is just a reduction over those columns.
+
+`BandReduction` crops spectra to wavelength windows and bins adjacent bands,
+so that tables hold only the wavelengths an analysis needs.
+"""
+import threading
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from ..instrument import stage
+
+
+Window = Tuple[float, float]
+
+
+class SpectralAxis:
+    def __init__(self, wavelengths: Sequence[float]):
+        self.wavelengths = np.asarray(wavelengths, dtype=float)
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.wavelengths)
+
+    def columns(self, window: Window) -> Union[slice, np.ndarray]:
+        """The columns within `window`, limits included; ValueError if none"""
+        start, end = sorted(map(float, window))
+        with self._lock:
+            columns = self._columns.get((start, end))
+        if columns is not None:
+            return columns
+        inside = np.flatnonzero((self.wavelengths >= start) & (self.wavelengths <= end))
+        if not len(inside):
+            raise ValueError(f"No wavelengths between {start:g} and {end:g} nm")
+        if inside[-1] - inside[0] + 1 == len(inside):
+            columns = slice(int(inside[0]), int(inside[-1]) + 1)
+        else:
+            columns = inside
+        with self._lock:
+            self._columns[(start, end)] = columns
+        return columns
+
+    def weights(self, window: Window) -> np.ndarray:
+        """A float32 vector that averages the columns within `window`"""
+        weights = np.zeros(len(self), dtype=np.float32)
+        columns = self.columns(window)
+        weights[columns] = 1
+        weights /= weights.sum()
+        return weights
+
+    def band_mean(self, X: np.ndarray, window: Window) -> np.ndarray:
+        """Mean of each row of X over the columns within `window`"""
+        return X[:, self.columns(window)].mean(axis=1, dtype=np.float32)
+
+
+def parse_windows(text: str) -> List[Window]:
+    """Parse wavelength windows given as "start-end", separated by , or ;"""
+    windows = []
+    for part in text.replace(";", ",").split(","):
+        if not part.strip():
+            continue
+        start, sep, end = part.partition("-")
+        try:
+            if not sep:
+                raise ValueError
+            windows.append(tuple(sorted((float(start), float(end)))))
+        except ValueError:
+            raise ValueError(f"'{part.strip()}' is not a wavelength range, e.g. 450-700") from None
+    return windows
+
+
+class BandReduction:
+    """Crops spectra to wavelength windows and averages adjacent bands.
+
+    `windows` are (start, end) in nm, limits included; None keeps all
+    wavelengths. The bands kept are averaged in groups of `binning`
+    consecutive bands; groups don't span the gaps between windows, so the
+    last group before a gap may be smaller. Each group's wavelength is the
+    mean of its bands'.
+
+    The reduction of an axis is worked out once, as a (bands x groups)
+    averaging matrix, so reducing a frame is one matrix product over the
+    span of bands kept; the output is contiguous float32.
+    """
+    def __init__(self, windows: Optional[Sequence[Window]] = None, binning: int = 1):
+        if binning < 1:
+            raise ValueError("Bands must be binned in groups of at least one")
+        self.windows = None if windows is None else [tuple(sorted(map(float, w))) for w in windows]
+        self.binning = int(binning)
+        self._plans = {}
+
+    @property
+    def is_identity(self) -> bool:
+        return self.windows is None and self.binning == 1
+
+    def _plan(self, wavelengths: np.ndarray):
+        key = wavelengths.tobytes()
+        plan = self._plans.get(key)
+        if plan is not None:
+            return plan
+        if self.windows is None:
+            kept = np.arange(len(wavelengths))
+        else:
+            inside = np.zeros(len(wavelengths), dtype=bool)
+            for start, end in self.windows:
+                inside |= (wavelengths >= start) & (wavelengths <= end)
+            kept = np.flatnonzero(inside)
+            if not len(kept):
+                raise ValueError("No wavelengths within " + ", ".join(
+                    f"{start:g}-{end:g} nm" for start, end in self.windows))
+        # Groups of `binning` within each run of consecutive bands
+        groups = []
+        for run in np.split(kept, np.flatnonzero(np.diff(kept) > 1) + 1):
+            groups += [run[i:i + self.binning] for i in range(0, len(run), self.binning)]
+        span = slice(int(kept[0]), int(kept[-1]) + 1)
+        matrix = np.zeros((span.stop - span.start, len(groups)), dtype=np.float32)
+        for column, group in enumerate(groups):
+            matrix[group - span.start, column] = 1 / len(group)
+        out_wavelengths = np.array([wavelengths[group].mean() for group in groups])
+        if self.binning > 1:
+            out_wavelengths = np.round(out_wavelengths, 2)
+        sizes = np.array([len(group) for group in groups])
+        plan = self._plans[key] = (span, kept, matrix, np.cumsum(sizes) - sizes, sizes,
+                                   out_wavelengths)
+        return plan
+
+    def wavelengths(self, wavelengths: Sequence[float]) -> np.ndarray:
+        """The wavelengths of reduced spectra"""
+        if self.is_identity:
+            return np.asarray(wavelengths)
+        return self._plan(np.asarray(wavelengths, dtype=float))[-1]
+
+    def __call__(self, spectra: np.ndarray, wavelengths: Sequence[float]
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+        """Reduced (rows x groups) spectra and their wavelengths"""
+        if self.is_identity:
+            return spectra, np.asarray(wavelengths)
+        span, kept, matrix, starts, sizes, out_wavelengths = \
+            self._plan(np.asarray(wavelengths, dtype=float))
+        with stage("reduce", rows=len(spectra), bands=len(out_wavelengths)) as reducing:
+            if self.binning == 1:
+                out = np.ascontiguousarray(spectra[:, kept], dtype=np.float32)
+            else:
+                out = np.matmul(spectra[:, span], matrix, dtype=np.float32)
+                # A NaN would spread to every group of its row through the
+                # zero weights; average those rows group by group instead
+                bad = np.flatnonzero(np.isnan(out).any(axis=1))
+                if len(bad):
+                    out[bad] = np.add.reduceat(spectra[bad][:, kept], starts, axis=1,
+                                               dtype=np.float32) / sizes
+            reducing.add(nbytes=out.nbytes)
+        return out, out_wavelengths
@@ -0,0 +1,21 @@
+"""Preview (scene) images of .lo frames."""
+import numpy as np
+
+
+def preview_array(scene: np.ndarray, factor: int = 1) -> np.ndarray:
+    """The scene as a 2-d array, optionally downscaled by `factor`.
+
+    Floating point scenes keep their dtype and are not copied unless they
+    must be made contiguous; integer scenes are converted to float32, which
+    holds 16-bit pixel values exactly. Downscaling averages blocks of
+    `factor` x `factor` pixels, dropping the incomplete blocks at the edges.
+    """
+    scene = np.squeeze(scene)
+    if scene.ndim != 2:
+        raise ValueError(f"Expected a 2-d scene image, not one of shape {scene.shape}")
+    dtype = scene.dtype if np.issubdtype(scene.dtype, np.floating) else np.float32
+    if factor <= 1:
+        return np.ascontiguousarray(scene, dtype=dtype)
+    height, width = scene.shape[0] // factor, scene.shape[1] // factor
+    blocks = scene[:height * factor, :width * factor].reshape(height, factor, width, factor)
+    return blocks.mean(axis=(1, 3), dtype=dtype)
@@ -0,0 +1,173 @@
+"""Spectral indices (NDVI and friends) computed from band means.
+
+An index is a formula over named bands, e.g. ``(nir - red) / (nir + red)``,
+where each band is the mean of the spectra over a wavelength window. An
+`IndexEngine` computes each band mean used by its formulas once, as a
+reduction over just the band's columns (see `SpectralAxis`), and every index
+from those few vectors. Band means can be kept between runs, so that editing
+one band of a formula recomputes only that band.
+"""
+import ast
+import operator
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from ..instrument import stage
+from .bands import SpectralAxis, Window
+
+
+# Wavelength windows (nm) of the bands standard indices refer to
+BANDS = {
+    "blue": (450, 495),
+    "green": (540, 570),
+    "red": (650, 680),
+    "rededge": (700, 730),
+    "nir": (785, 900),
+}
+
+INDICES = {
+    "NDVI": "(nir - red) / (nir + red)",
+    "NDRE": "(nir - rededge) / (nir + rededge)",
+    "GNDVI": "(nir - green) / (nir + green)",
+    "SAVI": "1.5 * (nir - red) / (nir + red + 0.5)",
+}
+
+_BINARY = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: operator.pow,
+}
+_UNARY = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+class Formula:
+    """An arithmetic expression over band names.
+
+    Only numbers, band names, + - * / ** and parentheses are allowed; the
+    expression is checked when parsed and never passed to eval().
+    """
+    def __init__(self, name: str, expression: str):
+        self.name = name
+        self.expression = expression
+        try:
+            self._tree = ast.parse(expression, mode="eval").body
+        except SyntaxError:
+            raise ValueError(f"{name}: invalid formula '{expression}'") from None
+        self.bands = set()
+        self._check(self._tree)
+
+    def _check(self, node):
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY:
+            self._check(node.left)
+            self._check(node.right)
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY:
+            self._check(node.operand)
+        elif isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            pass
+        elif isinstance(node, ast.Name):
+            self.bands.add(node.id)
+        else:
+            raise ValueError(f"{self.name}: '{ast.unparse(node)}' is not allowed in a formula")
+
+    def __call__(self, means: Dict[str, np.ndarray]) -> np.ndarray:
+        return self._evaluate(self._tree, means)
+
+    def _evaluate(self, node, means):
+        if isinstance(node, ast.BinOp):
+            return _BINARY[type(node.op)](self._evaluate(node.left, means),
+                                          self._evaluate(node.right, means))
+        if isinstance(node, ast.UnaryOp):
+            return _UNARY[type(node.op)](self._evaluate(node.operand, means))
+        if isinstance(node, ast.Constant):
+            return node.value
+        return means[node.id]
+
+
+def parse_formulas(text: str) -> List[Formula]:
+    """Parse formulas given as "name = expression", separated by ; or new lines"""
+    formulas = []
+    for line in text.replace(";", "\n").splitlines():
+        if not line.strip():
+            continue
+        name, sep, expression = line.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"'{line.strip()}' is not of the form name = expression")
+        formulas.append(Formula(name.strip(), expression.strip()))
+    return formulas
+
+
+# The ratio of two user-defined bands, b1 and b2; NDVI for red and near infrared
+BAND_RATIO = Formula("Band Ratio", "(b2 - b1) / (b2 + b1)")
+
+
+class IndexEngine:
+    """Computes a set of indices for spectra on the given axis (or wavelengths)"""
+    def __init__(self, axis: Union[SpectralAxis, Sequence[float]],
+                 formulas: Sequence[Formula],
+                 bands: Optional[Dict[str, Window]] = None):
+        bands = BANDS if bands is None else bands
+        self.axis = axis if isinstance(axis, SpectralAxis) else SpectralAxis(axis)
+        self.formulas = list(formulas)
+        names = [f.name for f in self.formulas]
+        if len(set(names)) < len(names):
+            raise ValueError("Indices must have different names")
+        used = set().union(*(f.bands for f in self.formulas))
+        unknown = used - set(bands)
+        if unknown:
+            raise ValueError(f"Unknown band(s): {', '.join(sorted(unknown))}")
+        # Only the bands the formulas use are averaged
+        self.bands = {name: tuple(window) for name, window in bands.items() if name in used}
+        for name, window in self.bands.items():
+            try:
+                self.axis.columns(window)
+            except ValueError as ex:
+                raise ValueError(f"{ex} for {name}") from None
+
+    @property
+    def names(self) -> List[str]:
+        return [f.name for f in self.formulas]
+
+    @property
+    def key(self) -> tuple:
+        """Identifies the output: the formulas and the columns of each band"""
+        columns = {}
+        for name, window in self.bands.items():
+            cols = self.axis.columns(window)
+            columns[name] = (cols.start, cols.stop) if isinstance(cols, slice) else tuple(cols)
+        return (tuple((f.name, ast.dump(f._tree)) for f in self.formulas),
+                tuple(sorted(columns.items())))
+
+    def band_means(self, X: np.ndarray,
+                   cache: Optional[Dict[Window, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        """Band means of X, reusing and filling `cache` (window -> means) if given"""
+        cache = {} if cache is None else cache
+        means = {}
+        for name, window in self.bands.items():
+            if window not in cache:
+                cache[window] = self.axis.band_mean(X, window)
+            means[name] = cache[window]
+        return means
+
+    def __call__(self, X: np.ndarray,
+                 cache: Optional[Dict[Window, np.ndarray]] = None) -> np.ndarray:
+        """(samples x indices) float32 array, NaN where an index is undefined"""
+        with stage("index", rows=len(X), indices=len(self.formulas)):
+            means = self.band_means(X, cache)
+            out = np.empty((len(X), len(self.formulas)), dtype=np.float32)
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                for column, formula in enumerate(self.formulas):
+                    out[:, column] = formula(means)
+            out[~np.isfinite(out)] = np.nan
+        return out
+
+
+def band_ratio(X: np.ndarray, wavelengths: Union[SpectralAxis, Sequence[float]],
+               band1: Window, band2: Window) -> np.ndarray:
+    """(b2 - b1) / (b2 + b1) of the means over two wavelength windows, per row"""
+    return IndexEngine(wavelengths, [BAND_RATIO], {"b1": band1, "b2": band2})(X)[:, 0]
@@ -0,0 +1,89 @@
+"""Rasters of scattered samples, for drawing them over an image.
+
+Drawing each of a frame's 100k+ sampling points as a marker is slow. A
+`PointRaster` bins the points instead into a grid of cells about as large
+as the spacing between samples, and gives the mean value in each cell as an
+image, NaN where a cell holds no samples, which is drawn as one image item.
+The cell of each point is found once per sampling pattern, so colouring the
+points by another band or index is a single pass over the values.
+"""
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ..instrument import stage
+
+
+# Cells are this many times the mean spacing between samples, so that few
+# cells within the sampled area are left empty
+CELL_FACTOR = 1.5
+
+
+class PointRaster:
+    """A grid of cells over (points x 2) x, y coordinates.
+
+    `cell` is the size of a cell in the points' coordinates; by default it
+    follows from the density of the points. Points with non-finite
+    coordinates are left out.
+    """
+    def __init__(self, points: np.ndarray, cell: Optional[float] = None):
+        points = np.asarray(points, dtype=np.float64)
+        finite = np.isfinite(points).all(axis=1)
+        self.n_points = len(points)
+        # None if every point is finite, which spares indexing the values
+        self._finite = None if finite.all() else finite
+        inside = points if self._finite is None else points[finite]
+        if not len(inside):
+            raise ValueError("No points with finite coordinates")
+        low, high = inside.min(axis=0), inside.max(axis=0)
+        if cell is None:
+            area = float(np.prod(np.maximum(high - low, 1)))
+            cell = CELL_FACTOR * np.sqrt(area / len(inside))
+        self.cell = float(cell)
+        self.origin = low
+        nx, ny = (np.floor((high - low) / self.cell).astype(int) + 1).tolist()
+        self.shape = (ny, nx)  # rows are y, as in images
+        cells = ((inside - low) // self.cell).astype(np.intp)
+        self._flat = cells[:, 1] * nx + cells[:, 0]
+        self._counts = np.bincount(self._flat, minlength=nx * ny)
+
+    @property
+    def extent(self) -> Tuple[float, float, float, float]:
+        """x, y, width and height of the grid in the points' coordinates"""
+        ny, nx = self.shape
+        return (float(self.origin[0]), float(self.origin[1]),
+                nx * self.cell, ny * self.cell)
+
+    def image(self, values: np.ndarray) -> np.ndarray:
+        """(rows x columns) float32 image of the mean of `values` per cell"""
+        with stage("overlay.raster", points=self.n_points, cells=self.shape):
+            values = np.asarray(values)
+            if self._finite is not None:
+                values = values[self._finite]
+            flat, counts = self._flat, self._counts
+            known = np.isfinite(values)
+            if not known.all():
+                flat, values = flat[known], values[known]
+                counts = np.bincount(flat, minlength=len(self._counts))
+            sums = np.bincount(flat, weights=values, minlength=len(counts))
+            with np.errstate(divide="ignore", invalid="ignore"):
+                # Empty cells are 0 / 0, i.e. NaN
+                return (sums / counts).astype(np.float32).reshape(self.shape)
+
+
+def points_in(points: np.ndarray, x0: float, y0: float, x1: float, y1: float) -> np.ndarray:
+    """Indices of the (points x 2) x, y points within the given rectangle"""
+    x, y = points[:, 0], points[:, 1]
+    return np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+
+
+def colour_levels(values: np.ndarray, percentiles=(1, 99)) -> Tuple[float, float]:
+    """Range for a colour map that isn't stretched by a few outliers"""
+    values = np.asarray(values)
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return 0.0, 1.0
+    low, high = np.percentile(values, percentiles)
+    if high <= low:
+        high = low + 1
+    return float(low), float(high)
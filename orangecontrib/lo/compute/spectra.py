@@ -0,0 +1,159 @@
+"""Spectra arrays of decoded .lo frames.
+
+These build the float32 arrays behind Spectra tables: a single frame's,
+converted only if needed, or those of many frames written into one
+preallocated array. Orange's Tables are put around them in `io.tables`.
+`SampleSelection` keeps only some of a frame's samples (an area, every n-th
+or a random fraction) before any of this.
+"""
+import tempfile
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+
+from ..instrument import stage
+
+
+SPECTRA_DTYPE = np.float32
+
+
+def empty_spectra(shape, memmap: bool = False) -> np.ndarray:
+    """Allocate a float32 spectra array, in an anonymous temporary file with `memmap`"""
+    if memmap:
+        # The file is removed on close; the mapping keeps its data alive
+        return np.asarray(np.memmap(tempfile.TemporaryFile(), dtype=SPECTRA_DTYPE,
+                                    mode="w+", shape=shape))
+    return np.empty(shape, dtype=SPECTRA_DTYPE)
+
+
+def spectra_array(spectra: np.ndarray, memmap: bool = False) -> np.ndarray:
+    """Return `spectra` as C-contiguous float32, copying only if needed.
+
+    With `memmap`, the data is copied into an anonymous temporary file.
+    """
+    if memmap:
+        out = empty_spectra(spectra.shape, memmap=True)
+        out[:] = spectra
+        return out
+    return np.ascontiguousarray(spectra, dtype=SPECTRA_DTYPE)
+
+
+def _fill(X: np.ndarray, metas: np.ndarray, first: int, frame) -> int:
+    rows = slice(first, first + len(frame.spectra))
+    X[rows] = frame.spectra
+    metas[rows, :2] = frame.coordinates
+    metas[rows, 2] = frame.frame
+    metas[rows, 3] = frame.timestamp
+    return rows.stop
+
+
+def stack_spectra(frames: Iterable, n_rows: Optional[int], memmap: bool = False,
+                  metas_dtype=np.float64, callback=None
+                  ) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Write the rows of `frames` into one array.
+
+    `frames` are frames or chunks with `frame`, `timestamp`, `wavelengths`,
+    `coordinates` and `spectra` (see `io.frames.FrameChunk`). Returns the
+    (rows x wavelengths) spectra, a (rows x 4) array of map_x, map_y, frame
+    number and timestamp, and the wavelengths (None if there were no frames).
+    If `n_rows`, the number of rows of all frames, is known, rows are written
+    straight into arrays of that size. If it is None, e.g. because only some
+    samples of each frame are selected, the frames are kept until the last
+    one is read and then copied into arrays of the size needed, so memory
+    follows the rows kept rather than the rows the frames had. `callback`,
+    if given, is called with the number of frames done.
+    """
+    wavelengths = None
+    kept = []
+    X = metas = None
+    row = 0
+    for i, frame in enumerate(frames):
+        if wavelengths is None:
+            wavelengths = frame.wavelengths
+            if n_rows is not None:
+                X = empty_spectra((n_rows, len(wavelengths)), memmap)
+                metas = np.empty((n_rows, 4), dtype=metas_dtype)
+        elif not np.array_equal(frame.wavelengths, wavelengths):
+            raise ValueError("Frames have different wavelengths and can't be stacked")
+        if X is None:
+            kept.append(frame)
+        else:
+            row = _fill(X, metas, row, frame)
+        if callback is not None:
+            callback(i + 1)
+    if wavelengths is None:
+        return None, None, None
+    if X is None:
+        n_rows = sum(len(frame.spectra) for frame in kept)
+        X = empty_spectra((n_rows, len(wavelengths)), memmap)
+        metas = np.empty((n_rows, 4), dtype=metas_dtype)
+        for frame in kept:
+            row = _fill(X, metas, row, frame)
+    elif row < n_rows:
+        X, metas = X[:row], metas[:row]  # only if `n_rows` was wrong
+    return X, metas, wavelengths
+
+
+# (min map_x, min map_y, max map_x, max map_y), limits included
+Box = Tuple[float, float, float, float]
+
+
+def parse_box(text: str) -> Optional[Box]:
+    """Parse "x0, y0, x1, y1" (map_x, map_y of two corners); None if empty"""
+    if not text.strip():
+        return None
+    try:
+        x0, y0, x1, y1 = map(float, text.replace(";", ",").split(","))
+    except ValueError:
+        raise ValueError(f"'{text.strip()}' is not an area given as x0, y0, x1, y1") from None
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+class SampleSelection:
+    """Selects the samples of a frame by position, before tables are built.
+
+    `box` keeps the samples whose map_x, map_y lie within it; of those,
+    every `stride`-th sample is kept, and of those, a random `fraction`.
+    The random subset depends only on `seed` and the number of candidates,
+    so frames with the same sampling pattern keep the same samples.
+    """
+    def __init__(self, box: Optional[Box] = None, stride: int = 1,
+                 fraction: float = 1.0, seed: int = 0):
+        if stride < 1:
+            raise ValueError("The stride must be at least one")
+        if not 0 < fraction <= 1:
+            raise ValueError("The fraction of samples must be above 0 and at most 1")
+        self.box = None if box is None else tuple(map(float, box))
+        self.stride = int(stride)
+        self.fraction = float(fraction)
+        self.seed = seed
+
+    @property
+    def is_identity(self) -> bool:
+        return self.box is None and self.stride == 1 and self.fraction == 1
+
+    def rows(self, coordinates: np.ndarray) -> np.ndarray:
+        """Indices of the samples kept, in order"""
+        coordinates = np.asarray(coordinates)
+        if self.box is None:
+            rows = np.arange(len(coordinates))
+        else:
+            x0, y0, x1, y1 = self.box
+            x, y = coordinates[:, 0], coordinates[:, 1]
+            rows = np.flatnonzero((x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+        rows = rows[::self.stride]
+        if self.fraction < 1 and len(rows):
+            n = max(1, int(round(self.fraction * len(rows))))
+            chosen = np.random.default_rng(self.seed).choice(len(rows), n, replace=False)
+            rows = rows[np.sort(chosen)]
+        return rows
+
+    def __call__(self, coordinates: np.ndarray, spectra: np.ndarray
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+        """The coordinates and spectra of the samples kept"""
+        if self.is_identity:
+            return coordinates, spectra
+        with stage("select", rows=len(spectra)) as selecting:
+            rows = self.rows(coordinates)
+            selecting.add(kept=len(rows))
+            return np.asarray(coordinates)[rows], spectra[rows]
@@ -0,0 +1,403 @@
+"""Upsampling of sparse Living Optics spectra onto a regular pixel grid.
+
+An upsampler turns the sampling pattern of a frame into a map from output
+pixels to samples: for nearest-neighbour upsampling, the index of the sample
+each pixel copies; for the interpolating upsamplers, a sparse
+(pixels x samples) matrix of weights, applied to all bands at once as a
+single matrix product. The sampling pattern of a sensor is the same in every
+frame, so maps are cached per pattern, output shape, origin and scale, and
+frames after the first cost only a gather or a sparse product.
+
+`UpsampledFrame` keeps the sparse spectra and the map, and expands them to a
+dense (pixels x bands) array only when asked to.
+
+Both can be limited to a region of interest (ROI) of the output grid. For
+large outputs, `upsample_tiled` works tile by tile instead, with maps built
+from only the samples around each tile, so that memory beyond the output
+itself scales with the tile size.
+"""
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.spatial import Delaunay, cKDTree
+
+from ..instrument import count, logger, stage
+
+
+MAX_CACHED_MAPS = 8
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+
+# Rows of the output grid mapped at once, to bound the temporaries
+_ROWS_PER_QUERY = 128
+
+# (first row, first column, end row, end column) of a region of the output grid
+Roi = Tuple[int, int, int, int]
+
+
+def coordinates_key(coordinates: np.ndarray) -> str:
+    """A digest identifying a sampling pattern"""
+    coordinates = np.ascontiguousarray(coordinates, dtype=np.float64)
+    return hashlib.sha1(coordinates.tobytes()).hexdigest() + str(coordinates.shape)
+
+
+def pixel_positions(rows: np.ndarray, columns: np.ndarray,
+                    origin: Tuple[float, float], scale: float) -> np.ndarray:
+    """Sensor positions of the given output pixels, as (pixels x 2).
+
+    Pixel (i, j) of the output lies at origin + (i, j) / scale in the
+    coordinates of the samples (map_x, map_y).
+    """
+    positions = np.empty((len(rows), len(columns), 2))
+    positions[..., 0] = origin[0] + rows[:, None] / scale
+    positions[..., 1] = origin[1] + columns[None, :] / scale
+    return positions.reshape(-1, 2)
+
+
+class Upsampler(ABC):
+    """Interpolation from a sampling pattern to arbitrary positions.
+
+    Subclasses implement `weights`, which returns a sparse
+    (positions x samples) matrix with rows summing to 1; a subclass without
+    it cannot be instantiated.
+    """
+    name = ""
+
+    def __init__(self, coordinates: np.ndarray):
+        self.coordinates = np.asarray(coordinates, dtype=np.float64)
+        self.tree = cKDTree(self.coordinates)
+
+    @abstractmethod
+    def weights(self, positions: np.ndarray) -> sp.csr_matrix:
+        pass
+
+    @staticmethod
+    def _csr(data, indices, n_positions, n_samples, per_row):
+        indptr = np.arange(0, n_positions * per_row + 1, per_row)
+        return sp.csr_matrix(
+            (data.astype(np.float32).ravel(), indices.astype(np.int32).ravel(), indptr),
+            shape=(n_positions, n_samples))
+
+
+class NearestUpsampler(Upsampler):
+    """Each position takes the spectrum of the nearest sample"""
+    name = "Nearest"
+
+    def nearest(self, positions: np.ndarray) -> np.ndarray:
+        _, nearest = self.tree.query(positions, workers=-1)
+        return nearest.astype(np.int32)
+
+    def weights(self, positions):
+        nearest = self.nearest(positions)
+        return self._csr(np.ones(len(nearest)), nearest,
+                         len(nearest), len(self.coordinates), 1)
+
+
+class LinearUpsampler(Upsampler):
+    """Barycentric interpolation in the Delaunay triangulation of the samples.
+
+    Positions outside the convex hull of the samples take the nearest sample.
+    """
+    name = "Linear"
+
+    def __init__(self, coordinates):
+        super().__init__(coordinates)
+        self.triangulation = Delaunay(self.coordinates)
+
+    def weights(self, positions):
+        tri = self.triangulation
+        simplex = tri.find_simplex(positions)
+        outside = simplex < 0
+        if outside.any():
+            _, simplex_nearest = self.tree.query(positions[outside], workers=-1)
+        transform = tri.transform[simplex]
+        partial = np.einsum("nij,nj->ni", transform[:, :2],
+                            positions - transform[:, 2])
+        data = np.column_stack((partial, 1 - partial.sum(axis=1)))
+        indices = tri.simplices[simplex]
+        if outside.any():
+            # A single weight of 1 on the nearest sample, padded with zeros
+            data[outside] = (1, 0, 0)
+            indices[outside] = np.column_stack(
+                (simplex_nearest, simplex_nearest, simplex_nearest))
+        weights = self._csr(data, indices, len(positions), len(self.coordinates), 3)
+        weights.eliminate_zeros()
+        return weights
+
+
+class IDWUpsampler(Upsampler):
+    """Inverse distance weighting of the `k` nearest samples"""
+    name = "Inverse distance"
+
+    K = 8
+
+    def __init__(self, coordinates, k=K, power=2):
+        super().__init__(coordinates)
+        self.k = min(k, len(self.coordinates))
+        self.power = power
+
+    def weights(self, positions):
+        distances, nearest = self.tree.query(positions, k=self.k, workers=-1)
+        distances = distances.reshape(len(positions), self.k)
+        nearest = nearest.reshape(len(positions), self.k)
+        # A position that coincides with a sample takes (almost) only that sample
+        data = 1 / np.maximum(distances, 1e-6) ** self.power
+        data /= data.sum(axis=1, keepdims=True)
+        return self._csr(data, nearest, len(positions), len(self.coordinates), self.k)
+
+
+UPSAMPLERS = {upsampler.name: upsampler
+              for upsampler in (NearestUpsampler, LinearUpsampler, IDWUpsampler)}
+
+
+def _grid_map(upsampler: Upsampler, rows, columns, origin, scale):
+    blocks = []
+    for first in range(0, len(rows), _ROWS_PER_QUERY):
+        block = rows[first:first + _ROWS_PER_QUERY]
+        positions = pixel_positions(block, columns, origin, scale)
+        if isinstance(upsampler, NearestUpsampler):
+            blocks.append(upsampler.nearest(positions))
+        else:
+            blocks.append(upsampler.weights(positions))
+    if isinstance(upsampler, NearestUpsampler):
+        return np.concatenate(blocks).reshape(len(rows), len(columns))
+    return sp.vstack(blocks, format="csr")
+
+
+_sdk_upsampler = None
+
+
+def _sdk_nearest_upsampler():
+    """The SDK's NearestUpSample, or None if it is not installed or disagrees.
+
+    NearestUpSample is the reference for which sample each pixel takes, but
+    the KD-tree engines and `upsample_tiled` place pixels by
+    `pixel_positions`. So the first time, the SDK is checked against that
+    convention on a small irregular pattern and an offset, scaled grid; if
+    it places pixels differently, it is not used, so that all engines
+    register the image the same way. Its module is imported on first use,
+    so that importing compute stays free of the SDK.
+    """
+    global _sdk_upsampler
+    if _sdk_upsampler is None:
+        try:
+            from lo.sdk.api.acquisition.data.coordinates import NearestUpSample
+        except ImportError:
+            NearestUpSample = False
+        if NearestUpSample:
+            probe = np.random.default_rng(0).uniform(0, 40, (60, 2))
+            shape, origin, scale = (13, 17), (1.3, -2.6), 0.45
+            sdk_map = _sdk_nearest_map(NearestUpSample, probe, shape, origin, scale)
+            ours = _grid_map(NearestUpsampler(probe), np.arange(shape[0]),
+                             np.arange(shape[1]), origin, scale)
+            if not np.array_equal(sdk_map, ours):
+                logger.warning("The SDK's NearestUpSample places pixels differently "
+                               "from origin + (i, j) / scale; not using it")
+                NearestUpSample = False
+        _sdk_upsampler = NearestUpSample
+    return _sdk_upsampler or None
+
+
+def _sdk_nearest_map(upsampler, coordinates, output_shape, origin, scale) -> np.ndarray:
+    # Upsampling the sample numbers themselves gives the map
+    upsampler = upsampler(coordinates, output_shape=tuple(output_shape),
+                          origin=tuple(origin), scale=scale)
+    samples = np.arange(len(coordinates), dtype=np.float64)[:, None]
+    return np.rint(upsampler(samples)).astype(np.int32).reshape(output_shape)
+
+
+def _nearest_map(coordinates, rows, columns, origin, scale) -> np.ndarray:
+    """Index of the sample nearest to each of the pixels `rows` x `columns`.
+
+    From the SDK if it is installed (see `_sdk_nearest_upsampler`), called
+    for just these pixels by moving the origin to the first of them, and
+    from a KD-tree otherwise.
+    """
+    upsampler = _sdk_nearest_upsampler()
+    if upsampler is None:
+        return _grid_map(NearestUpsampler(coordinates), rows, columns, origin, scale)
+    first = (origin[0] + rows[0] / scale, origin[1] + columns[0] / scale)
+    return _sdk_nearest_map(upsampler, coordinates, (len(rows), len(columns)),
+                            first, scale)
+
+
+def roi_bounds(output_shape: Tuple[int, int], roi: Optional[Roi] = None) -> Roi:
+    """Clip `roi` to the output grid; None stands for the whole grid"""
+    height, width = output_shape
+    if roi is None:
+        return 0, 0, height, width
+    row0, col0, row1, col1 = roi
+    row0, row1 = max(row0, 0), min(row1, height)
+    col0, col1 = max(col0, 0), min(col1, width)
+    if row0 >= row1 or col0 >= col1:
+        raise ValueError("Region of interest lies outside the output")
+    return row0, col0, row1, col1
+
+
+def pixel_coordinates(roi: Roi, dtype=np.float64) -> np.ndarray:
+    """(pixels x 2) coordinates of the pixels of `roi`, in row-major order"""
+    row0, col0, row1, col1 = roi
+    height, width = row1 - row0, col1 - col0
+    coordinates = np.empty((height * width, 2), dtype=dtype)
+    coordinates.reshape(height, width, 2)[..., 0] = np.arange(row0, row1)[:, None]
+    coordinates.reshape(height, width, 2)[..., 1] = np.arange(col0, col1)[None, :]
+    return coordinates
+
+
+def upsampling_map(coordinates: np.ndarray, output_shape: Tuple[int, int],
+                   origin: Tuple[float, float], scale: float,
+                   method: str = NearestUpsampler.name, roi: Optional[Roi] = None):
+    """Return the (cached) map of output pixels to samples.
+
+    For "Nearest", an array of sample indices with the shape of the `roi`
+    (by default, the whole output), from the SDK's NearestUpSample if it is
+    installed and from a KD-tree otherwise (see `_nearest_map`); otherwise a
+    sparse (pixels x samples) matrix of weights. Only the pixels of the ROI
+    are mapped. The result is shared and must not be modified.
+    """
+    roi = roi_bounds(output_shape, roi)
+    key = (method, coordinates_key(coordinates), tuple(output_shape),
+           tuple(origin), float(scale), roi)
+    with _maps_lock:
+        pixel_map = _maps.get(key)
+        if pixel_map is not None:
+            _maps.move_to_end(key)
+            count("upsample.map_hits")
+            return pixel_map
+    row0, col0, row1, col1 = roi
+    rows, columns = np.arange(row0, row1), np.arange(col0, col1)
+    with stage("upsample.map", method=method, samples=len(coordinates), roi=roi):
+        if method == NearestUpsampler.name:
+            pixel_map = _nearest_map(coordinates, rows, columns, origin, scale)
+        else:
+            pixel_map = _grid_map(UPSAMPLERS[method](coordinates),
+                                  rows, columns, origin, scale)
+    if isinstance(pixel_map, np.ndarray):
+        pixel_map.flags.writeable = False
+    with _maps_lock:
+        _maps[key] = pixel_map
+        while len(_maps) > MAX_CACHED_MAPS:
+            _maps.popitem(last=False)
+    return pixel_map
+
+
+def nearest_index(coordinates: np.ndarray, output_shape: Tuple[int, int],
+                  origin: Tuple[float, float], scale: float) -> np.ndarray:
+    """Return the index of the sample nearest to each output pixel"""
+    return upsampling_map(coordinates, output_shape, origin, scale)
+
+
+class UpsampledFrame:
+    """An upsampled frame kept as sparse spectra and a pixel -> sample map.
+
+    Either `index[i, j]` is the row of `spectra` that supplies pixel (i, j),
+    or `weights` is a sparse (pixels x samples) matrix that mixes them.
+    """
+    def __init__(self, spectra: np.ndarray, shape: Tuple[int, int],
+                 index: Optional[np.ndarray] = None,
+                 weights: Optional[sp.csr_matrix] = None,
+                 offset: Tuple[int, int] = (0, 0)):
+        self.spectra = spectra
+        self.shape = tuple(shape)
+        self.index = index
+        self.weights = weights
+        # Position of the first pixel in the full output grid, when upsampling a ROI
+        self.offset = offset
+
+    def __len__(self):
+        return self.shape[0] * self.shape[1]
+
+    def pixel_coordinates(self, dtype=np.float64) -> np.ndarray:
+        """(pixels x 2) array of pixel coordinates, in row-major pixel order"""
+        row0, col0 = self.offset
+        return pixel_coordinates(
+            (row0, col0, row0 + self.shape[0], col0 + self.shape[1]), dtype)
+
+    def expand(self, pixels: Optional[np.ndarray] = None) -> np.ndarray:
+        """Dense (pixels x bands) spectra, for all pixels or the given ones.
+
+        This is a single gather, or a single sparse product, from the sparse
+        spectra; it is the only place a dense cube is allocated.
+        """
+        with stage("upsample.expand") as expanding:
+            if self.index is not None:
+                index = self.index.reshape(-1)
+                if pixels is not None:
+                    index = index[pixels]
+                dense = self.spectra[index]
+            else:
+                weights = self.weights if pixels is None else self.weights[pixels]
+                dense = np.asarray(weights @ self.spectra, dtype=self.spectra.dtype)
+            expanding.add(nbytes=dense.nbytes)
+        return dense
+
+
+def upsample_frame(spectra: np.ndarray, coordinates: np.ndarray,
+             output_shape: Tuple[int, int], origin: Tuple[float, float],
+             scale: float, method: str = NearestUpsampler.name,
+             roi: Optional[Roi] = None) -> UpsampledFrame:
+    row0, col0, row1, col1 = roi = roi_bounds(output_shape, roi)
+    pixel_map = upsampling_map(coordinates, output_shape, origin, scale, method, roi)
+    shape, offset = (row1 - row0, col1 - col0), (row0, col0)
+    if isinstance(pixel_map, np.ndarray):
+        return UpsampledFrame(spectra, shape, index=pixel_map, offset=offset)
+    return UpsampledFrame(spectra, shape, weights=pixel_map, offset=offset)
+
+
+def upsample_tiled(spectra: np.ndarray, coordinates: np.ndarray,
+                   output_shape: Tuple[int, int], origin: Tuple[float, float],
+                   scale: float, method: str = NearestUpsampler.name,
+                   roi: Optional[Roi] = None, tile_size: int = 256,
+                   out: Optional[np.ndarray] = None) -> np.ndarray:
+    """Upsample the `roi` tile by tile into dense (pixels x bands) spectra.
+
+    Each tile is mapped from the samples within a margin of a few sample
+    spacings around it, so only those samples are touched and the
+    temporaries scale with `tile_size`; maps are not cached. Pixels are in
+    row-major order of the ROI. `out`, if given, receives the result, which
+    is the same as that of `upsample_frame` with the same arguments.
+    """
+    with stage("upsample.tiled", method=method, tile_size=tile_size) as tiling:
+        row0, col0, row1, col1 = roi_bounds(output_shape, roi)
+        coordinates = np.asarray(coordinates, dtype=np.float64)
+        n_bands = spectra.shape[1]
+        if out is None:
+            out = np.empty(((row1 - row0) * (col1 - col0), n_bands), dtype=spectra.dtype)
+        cube = out.reshape(row1 - row0, col1 - col0, n_bands)
+
+        # Typical distance between samples, from the area they cover
+        extent = np.ptp(coordinates, axis=0)
+        spacing = np.sqrt(max(extent[0] * extent[1], 1) / max(len(coordinates), 1))
+        needed = IDWUpsampler.K if method == IDWUpsampler.name else 3
+
+        for first_row in range(row0, row1, tile_size):
+            rows = np.arange(first_row, min(first_row + tile_size, row1))
+            for first_col in range(col0, col1, tile_size):
+                columns = np.arange(first_col, min(first_col + tile_size, col1))
+                positions = pixel_positions(rows, columns, origin, scale)
+                low, high = positions.min(axis=0), positions.max(axis=0)
+                margin = 4 * spacing
+                while True:
+                    inside = np.all((coordinates >= low - margin)
+                                    & (coordinates <= high + margin), axis=1)
+                    local = np.flatnonzero(inside)
+                    if len(local) >= min(8 * needed, len(coordinates)):
+                        break
+                    margin *= 2
+                if method == NearestUpsampler.name:
+                    # The same source of maps as `upsampling_map`, so tiles line up with it
+                    nearest = _nearest_map(coordinates[local], rows, columns, origin, scale)
+                    tile = spectra[local[nearest.ravel()]]
+                else:
+                    upsampler = UPSAMPLERS[method](coordinates[local])
+                    tile = upsampler.weights(positions) @ spectra[local]
+                cube[rows[0] - row0:rows[-1] + 1 - row0,
+                     columns[0] - col0:columns[-1] + 1 - col0] = \
+                    tile.reshape(len(rows), len(columns), n_bands)
+        tiling.add(nbytes=out.nbytes)
+        return out
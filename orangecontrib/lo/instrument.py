@@ -0,0 +1,129 @@
+"""Timing and size instrumentation of the add-on's hot paths.
+
+Code wraps its stages (opening and decoding frames, building tables,
+upsampling, computing indices) in `stage()` and counts events (cache hits,
+bytes read) with `count()`. Both do nothing until instrumentation is turned
+on, with `enable()` or by setting the environment variable
+ORANGE_LO_INSTRUMENT=1; `stage()` then returns a shared no-op context
+manager, so instrumented code costs a function call and a flag test.
+
+When on, each stage is logged (at DEBUG level, to the "orangecontrib.lo"
+logger), added to the totals returned by `stats()` and passed, as an
+`Event`, to the tracer given to `enable()`, if any:
+
+    from orangecontrib.lo import instrument
+
+    instrument.enable(tracer=print)
+    ...
+    print(instrument.stats())
+"""
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, namedtuple
+from typing import Callable, Optional
+
+
+logger = logging.getLogger("orangecontrib.lo")
+
+# `fields` are the keyword arguments given to stage(), e.g. nbytes or shape
+Event = namedtuple("Event", ["name", "start", "seconds", "fields"])
+
+_enabled = os.environ.get("ORANGE_LO_INSTRUMENT", "") not in ("", "0")
+_tracer = None  # type: Optional[Callable[[Event], None]]
+_lock = threading.Lock()
+_stages = defaultdict(lambda: [0, 0.0, 0])  # name -> [calls, seconds, bytes]
+_counters = defaultdict(int)
+
+
+def enable(tracer: Optional[Callable[[Event], None]] = None):
+    """Turn instrumentation on; `tracer` is called with every finished stage"""
+    global _enabled, _tracer
+    _tracer = tracer
+    _enabled = True
+
+
+def disable():
+    global _enabled, _tracer
+    _enabled = False
+    _tracer = None
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+class _Stage:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.start = None
+
+    def add(self, **fields):
+        """Record more fields, e.g. sizes only known at the end of the stage"""
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        seconds = time.perf_counter() - self.start
+        nbytes = self.fields.get("nbytes", 0)
+        with _lock:
+            totals = _stages[self.name]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += nbytes
+        logger.debug("%s: %.2f ms %s", self.name, 1000 * seconds, self.fields)
+        tracer = _tracer
+        if tracer is not None:
+            tracer(Event(self.name, self.start, seconds, self.fields))
+
+
+class _NoStage:
+    __slots__ = ()
+
+    def add(self, **_):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str, **fields):
+    """Context manager that times a stage; `nbytes`, if given, is totalled"""
+    if not _enabled:
+        return _NO_STAGE
+    return _Stage(name, fields)
+
+
+def count(name: str, n: int = 1):
+    """Add `n` to a counter, e.g. "cache.hits" or "read.nbytes" """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] += n
+
+
+def stats() -> dict:
+    """Totals since the last `reset()`: stages and counters"""
+    with _lock:
+        return {"stages": {name: {"calls": calls, "seconds": seconds, "nbytes": nbytes}
+                           for name, (calls, seconds, nbytes) in _stages.items()},
+                "counters": dict(_counters)}
+
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
@@ -1 +1,3 @@
-from .lo import LOReader
\ No newline at end of file
+from .lo import LOReader
+from .lonpz import LONpzReader
+from .frames import DecodingPool, aggregate_frames, iter_frames, iter_tables, stack_frames
@@ -0,0 +1,21 @@
+"""Deferred import of the Living Optics SDK.
+
+Orange imports the add-on's readers and widgets when the canvas starts, so
+importing the SDK at the top of a module would make every start pay for
+it, even if no .lo file is ever opened. Modules call `lo_open` from here
+instead, which imports the SDK the first time a file is opened.
+"""
+_open = None
+
+
+def lo_open(filename, *args, **kwargs):
+    """The SDK's `lo.sdk.api.acquisition.io.open.open`, imported on first use"""
+    global _open
+    if _open is None:
+        try:
+            from lo.sdk.api.acquisition.io.open import open as sdk_open
+        except ImportError as ex:
+            raise ImportError("Reading .lo files needs the Living Optics SDK; "
+                              "see the add-on's installation instructions") from ex
+        _open = sdk_open
+    return _open(filename, *args, **kwargs)
@@ -0,0 +1,148 @@
+"""Bounded LRU cache of decoded .lo frames with optional read-ahead.
+
+Frames are kept as the ``(metadata, scene, spectra)`` tuples returned by the
+SDK reader, keyed on the file's path and on the seek position and timestamp
+of the frame, as recorded in the file's index. A file that is being written
+thus keeps its cached frames as it grows, without a stat() per lookup, and a
+frame rewritten in place has another timestamp. The cache holds at most
+`max_bytes` of scene and spectra arrays; the least recently used frames are
+dropped first.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from orangecontrib.lo.instrument import count, stage
+
+from ._sdk import lo_open
+from .index import FrameEntry
+
+
+def read_frame(filename: str, position: int) -> tuple:
+    """Read the frame at `position` as (metadata, scene, spectra)"""
+    with stage("open", filename=filename):
+        f = lo_open(filename)
+    with f:
+        with stage("seek", position=position):
+            f.seek(position)
+        with stage("decode") as decoding:
+            frame = f.read()
+            decoding.add(nbytes=frame_nbytes(frame))
+    return frame
+
+
+def frame_nbytes(frame: tuple) -> int:
+    metadata, scene, spectra = frame
+    coordinates = getattr(metadata, "sampling_coordinates", None)
+    return scene.nbytes + spectra.nbytes + getattr(coordinates, "nbytes", 0)
+
+
+class FrameCache:
+    def __init__(self, max_bytes: int = 512 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._frames = OrderedDict()
+        self._sizes = {}
+        self._nbytes = 0
+        self._pending = {}  # frames being read ahead, key -> Future
+        self._lock = threading.Lock()
+        # One thread is enough: read-ahead should not compete with the frame being shown
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @staticmethod
+    def _key(filename: str, entry: FrameEntry) -> tuple:
+        return os.path.abspath(filename), entry.offset, entry.timestamp_s, entry.timestamp_us
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._frames)
+
+    def get(self, filename: str, entry: FrameEntry) -> tuple:
+        """Return the frame indexed by `entry`, reading it if it is not cached"""
+        key = self._key(filename, entry)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                count("cache.hits")
+                return frame
+            pending = self._pending.get(key)
+        if pending is not None:
+            try:
+                frame = pending.result()
+                count("cache.read_ahead_hits")
+                return frame
+            except Exception:  # pylint: disable=broad-except
+                pass  # cancelled or failed; read it here and report any error
+        count("cache.misses")
+        frame = read_frame(filename, entry.offset)
+        self._put(key, frame)
+        return frame
+
+    def put(self, filename: str, entry: FrameEntry, frame: tuple):
+        """Add a frame read elsewhere, e.g. while indexing the file"""
+        self._put(self._key(filename, entry), frame)
+
+    def prefetch(self, filename: str, entries: Iterable[FrameEntry]):
+        """Read the given frames in the background.
+
+        Read-ahead requested earlier for other frames is cancelled if it has
+        not started yet, so scrubbing quickly doesn't build up a backlog.
+        """
+        keys = {self._key(filename, entry): entry.offset for entry in entries}
+        with self._lock:
+            for key, future in list(self._pending.items()):
+                if key not in keys and future.cancel():
+                    del self._pending[key]
+            for key, position in keys.items():
+                if key in self._frames or key in self._pending:
+                    continue
+                self._pending[key] = self._executor.submit(
+                    self._read_ahead, key, filename, position)
+
+    def _read_ahead(self, key, filename, position):
+        try:
+            frame = read_frame(filename, position)
+            self._put(key, frame)
+            return frame
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _put(self, key, frame):
+        size = frame_nbytes(frame)
+        with self._lock:
+            # A frame larger than the whole budget would only evict everything else
+            if key in self._frames or size > self.max_bytes:
+                return
+            self._frames[key] = frame
+            self._sizes[key] = size
+            self._nbytes += size
+            self._evict()
+
+    def _evict(self):
+        while self._nbytes > self.max_bytes and self._frames:
+            key, _ = self._frames.popitem(last=False)
+            self._nbytes -= self._sizes.pop(key)
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._sizes.clear()
+            self._nbytes = 0
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+        self._executor.shutdown(wait=False)
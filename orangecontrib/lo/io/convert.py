@@ -0,0 +1,225 @@
+"""Conversion of .lo files into per-frame NumPy archives.
+
+Reading a .lo file decodes every frame it touches. Converting a capture
+once writes each frame's spectra, sampling coordinates, wavelengths and
+timestamp into its own (compressed) .npz file, next to a small JSON manifest
+with the extension .lonpz, which `LONpzReader` opens in Orange without the
+SDK:
+
+    capture.lo  ->  capture.lonpz             manifest
+                    capture.lonpz.d/000000.npz, 000001.npz, ...
+
+Frames of all given files are converted in parallel in worker processes.
+Conversion is incremental: frames whose archive already exists are skipped,
+so converting a capture again only adds the frames appended since. The
+manifest records the path, modification time and size of the .lo file; if
+the file was replaced or re-recorded rather than appended to, all its frames
+are converted again.
+
+    lo-convert capture.lo other.lo --output converted/ --processes 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from ._sdk import lo_open
+from .cache import read_frame
+from .index import FrameEntry
+from .lonpz import MANIFEST_EXTENSION, MANIFEST_VERSION, frame_file, frames_dir
+
+
+def manifest_path(filename: str, output_dir: Optional[str] = None) -> str:
+    """The manifest for `filename`: next to it, or in `output_dir` by its base name"""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return os.path.join(output_dir or os.path.dirname(os.path.abspath(filename)),
+                        stem + MANIFEST_EXTENSION)
+
+
+def _convert_frame(filename: str, position: int, path: str, compress: bool) -> FrameEntry:
+    # Runs in a worker process. The archive is written under another name and
+    # renamed, so an interrupted conversion never leaves a truncated frame.
+    metadata, _, spectra = read_frame(filename, position)
+    entry = FrameEntry(position, position, int(metadata.timestamp_s),
+                       int(metadata.timestamp_us), len(spectra))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        (np.savez_compressed if compress else np.savez)(
+            f,
+            spectra=np.asarray(spectra, dtype=np.float32),
+            coordinates=np.asarray(metadata.sampling_coordinates),
+            wavelengths=np.asarray(metadata.wavelengths),
+            entry=np.array(entry, dtype=np.int64))
+    os.replace(tmp, path)
+    return entry
+
+
+def _existing_entry(path: str) -> Optional[FrameEntry]:
+    try:
+        with np.load(path) as archive:
+            return FrameEntry(*(int(v) for v in archive["entry"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None  # missing or unreadable; convert the frame (again)
+
+
+def _source_stamp(filename: str) -> Dict:
+    stat = os.stat(filename)
+    return {"source": os.path.abspath(filename),
+            "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _manifest_state(manifest: str) -> Optional[Dict]:
+    try:
+        with open(manifest, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _reusable(filename: str, manifest: str, stamp: Dict,
+              existing: List[FrameEntry], n_frames: int) -> bool:
+    """Whether the frames converted before still belong to `filename`.
+
+    They do if the file is unchanged since, or if it has only grown and
+    the last frame converted is still the same, as in `FrameIndex.extend`.
+    ValueError if the manifest belongs to another file of the same name.
+    """
+    state = _manifest_state(manifest)
+    if state is not None and state.get("source", stamp["source"]) != stamp["source"]:
+        raise ValueError(f"{manifest} holds the frames of {state['source']}, not of "
+                         f"{stamp['source']}; convert into another directory, "
+                         f"or use --force to replace them")
+    if state is not None and (state.get("mtime_ns"), state.get("size")) \
+            == (stamp["mtime_ns"], stamp["size"]):
+        return True
+    if state is not None and stamp["size"] < state.get("size", 0):
+        return False
+    last = max(existing, key=lambda e: e.frame)
+    if last.frame >= n_frames:
+        return False
+    try:
+        metadata, _, _ = read_frame(filename, last.offset)
+    except (EOFError, OSError, ValueError):
+        return False
+    return (int(metadata.timestamp_s), int(metadata.timestamp_us)) \
+        == (last.timestamp_s, last.timestamp_us)
+
+
+def _write_manifest(manifest: str, stamp: Dict, entries: List[FrameEntry]):
+    entries = sorted(entries, key=lambda e: e.frame)
+    with np.load(frame_file(manifest, entries[0].frame)) as archive:
+        wavelengths = archive["wavelengths"].tolist()
+    state = {"version": MANIFEST_VERSION,
+             **stamp,
+             "wavelengths": wavelengths,
+             "frames": [list(e) for e in entries]}
+    tmp = f"{manifest}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, manifest)
+
+
+def convert(filenames: Iterable[str], output_dir: Optional[str] = None,
+            processes: Optional[int] = None, compress: bool = True,
+            force: bool = False, callback=None) -> List[str]:
+    """Convert .lo files and return the paths of their manifests.
+
+    Frames are converted by `processes` worker processes (default: one per
+    core; 0 converts here). Frames already converted are skipped unless
+    `force` is set, or the file has changed other than by growing.
+    `callback`, if given, is called with the number of frames done and the
+    number to do. ValueError if two files would share a manifest, e.g.
+    files of the same name in different directories, with `output_dir`.
+    """
+    filenames = list(filenames)
+    manifests = [manifest_path(filename, output_dir) for filename in filenames]
+    sources = {}
+    for filename, manifest in zip(filenames, manifests):
+        other = sources.setdefault(manifest, filename)
+        if os.path.abspath(other) != os.path.abspath(filename):
+            raise ValueError(f"{other} and {filename} would both be converted to {manifest}")
+
+    jobs, done, stamps = [], {}, {}
+    for filename, manifest in zip(filenames, manifests):
+        if manifest in done:
+            continue  # the same file given twice
+        os.makedirs(frames_dir(manifest), exist_ok=True)
+        done[manifest] = []
+        stamps[manifest] = stamp = _source_stamp(filename)
+        with lo_open(filename) as f:
+            n_frames = len(f)
+        paths = [frame_file(manifest, position) for position in range(n_frames)]
+        existing = [None] * n_frames if force else [_existing_entry(path) for path in paths]
+        known = [entry for entry in existing if entry is not None]
+        if known and not _reusable(filename, manifest, stamp, known, n_frames):
+            existing = [None] * n_frames
+        for position, (path, entry) in enumerate(zip(paths, existing)):
+            if entry is None:
+                jobs.append((filename, manifest, position, path))
+            else:
+                done[manifest].append(entry)
+
+    def finished(manifest, entry, n_done):
+        done[manifest].append(entry)
+        if callback is not None:
+            callback(n_done, len(jobs))
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(jobs) <= 1:
+        for i, (filename, manifest, position, path) in enumerate(jobs):
+            finished(manifest, _convert_frame(filename, position, path, compress), i + 1)
+    else:
+        # Workers are spawned rather than forked, as in io.frames
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(min(processes, len(jobs)), mp_context=context) as pool:
+            futures = {pool.submit(_convert_frame, filename, position, path, compress): manifest
+                       for filename, manifest, position, path in jobs}
+            for i, future in enumerate(as_completed(futures)):
+                finished(futures[future], future.result(), i + 1)
+
+    for manifest, entries in done.items():
+        if entries:
+            _write_manifest(manifest, stamps[manifest], entries)
+    return manifests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="lo-convert",
+        description="Convert Living Optics .lo files into per-frame NumPy archives "
+                    "that Orange opens without decoding.")
+    parser.add_argument("files", nargs="+", metavar="FILE.lo")
+    parser.add_argument("-o", "--output", metavar="DIR",
+                        help="directory for the converted files (default: next to each file)")
+    parser.add_argument("-j", "--processes", type=int, default=None,
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument("--uncompressed", action="store_true",
+                        help="store frames uncompressed; larger, but faster to open")
+    parser.add_argument("--force", action="store_true",
+                        help="convert all frames, including those converted before")
+    args = parser.parse_args(argv)
+
+    def progress(n_done, n_jobs):
+        print(f"\rConverted {n_done}/{n_jobs} frames", end="", file=sys.stderr)
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    try:
+        manifests = convert(args.files, args.output, args.processes,
+                            compress=not args.uncompressed, force=args.force,
+                            callback=progress)
+    except ValueError as ex:
+        parser.error(str(ex))
+    print(file=sys.stderr)
+    for manifest in manifests:
+        print(manifest)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""Reading many frames of a .lo file at once.
+
+`iter_frames` streams frames, or chunks of their rows, as plain NumPy arrays
+and needs neither Qt nor Orange widgets, so it serves scripts and batch jobs
+as well as the widgets; `stack_frames` builds on it to read a range of frames
+into a single Table, and `aggregate_frames` to summarise them, per sampling
+point, into one. Frames are decoded in the calling process by default;
+long ranges can be decoded in a pool of worker processes instead, and are
+then handed back in file order, with only a few frames in flight at a time.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from Orange.data import Table
+
+from orangecontrib.lo.compute.aggregate import FrameStatistics
+from orangecontrib.lo.compute.bands import BandReduction
+from orangecontrib.lo.compute.indices import Formula, IndexEngine
+from orangecontrib.lo.compute.spectra import SampleSelection, spectra_array, stack_spectra
+from orangecontrib.lo.instrument import stage
+
+from ._sdk import lo_open
+from .index import frame_index
+from .tables import lo_domain, spectra_domain, stacked_domain, table_from_arrays
+
+
+DecodedFrame = namedtuple(
+    "DecodedFrame",
+    ["position", "timestamp", "wavelengths", "coordinates", "spectra"])
+
+# `rows` is the slice of the frame's rows held in `coordinates` and `spectra`
+FrameChunk = namedtuple(
+    "FrameChunk",
+    ["frame", "timestamp", "rows", "wavelengths", "coordinates", "spectra"])
+
+
+def _decoded(position, metadata, spectra,
+             reduction: Optional[BandReduction] = None,
+             selection: Optional[SampleSelection] = None) -> DecodedFrame:
+    wavelengths = np.asarray(metadata.wavelengths)
+    coordinates = np.asarray(metadata.sampling_coordinates)
+    if selection is not None:
+        coordinates, spectra = selection(coordinates, spectra)
+    if reduction is not None:
+        spectra, wavelengths = reduction(spectra, wavelengths)
+    return DecodedFrame(
+        position,
+        metadata.timestamp_s + metadata.timestamp_us * 1e-6,
+        wavelengths,
+        coordinates,
+        spectra_array(spectra))
+
+
+def _decode(filename: str, position: int,
+            reduction: Optional[BandReduction] = None,
+            selection: Optional[SampleSelection] = None) -> DecodedFrame:
+    # Runs in a worker process; SDK metadata objects need not be picklable
+    with lo_open(filename) as f:
+        f.seek(position)
+        (metadata, _, spectra) = f.read()
+    return _decoded(position, metadata, spectra, reduction, selection)
+
+
+class DecodingPool:
+    """Worker processes for decoding frames, started on first use and then kept.
+
+    Each worker imports the SDK and Orange, which takes seconds, so a pool
+    is only worth starting for long ranges of frames, and worth keeping for
+    the next one; a widget holds one and shuts it down when deleted. Ranges
+    of fewer than `min_frames` frames are decoded by the caller.
+    """
+    def __init__(self, processes: Optional[int] = None, min_frames: int = 32):
+        self.processes = processes or os.cpu_count() or 1
+        self.min_frames = min_frames
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def executor(self, n_frames: int) -> Optional[ProcessPoolExecutor]:
+        """The pool for decoding `n_frames` frames, or None if not worth it"""
+        if self.processes <= 1 or n_frames < self.min_frames:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # Workers are spawned rather than forked, which is unsafe in a Qt application
+                self._executor = ProcessPoolExecutor(
+                    self.processes, mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def decoded_frames(filename: str, positions: Iterable[int],
+                   processes: int = 0,
+                   reduction: Optional[BandReduction] = None,
+                   selection: Optional[SampleSelection] = None,
+                   pool: Optional[DecodingPool] = None) -> Iterator[DecodedFrame]:
+    """Yield the frames at `positions` in order.
+
+    By default, frames are read here, through a single file handle. With
+    `processes` > 1, they are decoded by a pool of that many worker
+    processes, started for this call; with `pool`, by its workers if there
+    are enough frames for it (see `DecodingPool`). At most two frames per
+    worker are decoded ahead of the consumer. With `selection` and
+    `reduction`, samples are selected and spectra cropped and binned as
+    each frame is decoded, in the workers, so only what is kept is passed
+    back.
+    """
+    positions = list(positions)
+    executor = pool.executor(len(positions)) if pool is not None else None
+    if executor is not None:
+        yield from _decoded_in(executor, pool.processes, filename, positions,
+                               reduction, selection)
+        return
+    if processes <= 1 or len(positions) <= 1:
+        with lo_open(filename) as f:
+            for position in positions:
+                with stage("seek", position=position):
+                    f.seek(position)
+                with stage("decode") as decoding:
+                    (metadata, _, spectra) = f.read()
+                    decoding.add(nbytes=spectra.nbytes)
+                yield _decoded(position, metadata, spectra, reduction, selection)
+        return
+
+    # Workers are spawned rather than forked, which is unsafe in a Qt application
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(min(processes, len(positions)), mp_context=context) as executor:
+        yield from _decoded_in(executor, processes, filename, positions,
+                               reduction, selection)
+
+
+def _decoded_in(executor, processes, filename, positions, reduction, selection):
+    todo = iter(positions)
+    pending = deque(executor.submit(_decode, filename, position, reduction, selection)
+                    for _, position in zip(range(2 * processes), todo))
+    try:
+        while pending:
+            frame = pending.popleft().result()
+            for position in todo:
+                pending.append(
+                    executor.submit(_decode, filename, position, reduction, selection))
+                break
+            yield frame
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_frames(filename: str, start: int = 0, stop: Optional[int] = None,
+                step: int = 1, chunk_rows: Optional[int] = None,
+                processes: int = 0,
+                reduction: Optional[BandReduction] = None,
+                selection: Optional[SampleSelection] = None,
+                pool: Optional[DecodingPool] = None) -> Iterator[FrameChunk]:
+    """Yield frames `start:stop:step` of a .lo file as `FrameChunk`s.
+
+    With `chunk_rows`, each frame is split into chunks of at most that many
+    rows; chunks are views of the decoded frame. Peak memory is one decoded
+    frame, or two per worker if decoded in worker processes (see
+    `decoded_frames`).
+    `selection` keeps only some of each frame's samples, and `reduction`
+    crops and bins their spectra.
+    """
+    with lo_open(filename) as f:
+        positions = range(len(f))[start:stop:step]
+    for frame in decoded_frames(filename, positions, processes, reduction, selection,
+                                pool):
+        n_rows = len(frame.spectra)
+        size = chunk_rows or n_rows or 1
+        for first in range(0, n_rows, size):
+            rows = slice(first, min(first + size, n_rows))
+            yield FrameChunk(frame.position, frame.timestamp, rows,
+                             frame.wavelengths, frame.coordinates[rows],
+                             frame.spectra[rows])
+
+
+def stack_frames(filename: str, start: int = 0, stop: Optional[int] = None,
+                 step: int = 1, processes: int = 0,
+                 memmap: bool = False, callback=None,
+                 reduction: Optional[BandReduction] = None,
+                 selection: Optional[SampleSelection] = None,
+                 pool: Optional[DecodingPool] = None) -> Table:
+    """Read frames `start:stop:step` into a single Table.
+
+    Rows of all frames are written into one preallocated array (sized from
+    the frame index), with the frame number and timestamp of each row added
+    to the metas. `selection` and `reduction` select samples and crop and
+    bin the spectra of each frame before it is stacked; with a selection,
+    the array is sized once all frames are read (see `stack_spectra`).
+    `callback`, if given, is called with the fraction done and may raise to
+    abandon reading.
+    """
+    entries = frame_index(filename)[start:stop:step]
+    if not entries:
+        raise ValueError("No frames in the selected range")
+    n_rows = sum(e.samples for e in entries)
+
+    with stage("table.stack", frames=len(entries), rows=n_rows) as stacking:
+        # Orange keeps metas as objects; filling them directly avoids another copy
+        X, metas, wavelengths = stack_spectra(
+            iter_frames(filename, start, stop, step, processes=processes,
+                        reduction=reduction, selection=selection, pool=pool),
+            n_rows if selection is None else None, memmap, metas_dtype=object,
+            callback=None if callback is None else lambda done: callback(done / len(entries)))
+        stacking.add(nbytes=X.nbytes)
+        return table_from_arrays(stacked_domain(wavelengths), X, metas)
+
+
+def aggregate_frames(filename: str, statistics: Sequence[str] = ("mean",),
+                     start: int = 0, stop: Optional[int] = None, step: int = 1,
+                     processes: int = 0, callback=None,
+                     reduction: Optional[BandReduction] = None,
+                     selection: Optional[SampleSelection] = None,
+                     formulas: Optional[Sequence[Formula]] = None,
+                     pool: Optional[DecodingPool] = None) -> Table:
+    """Statistics of frames `start:stop:step`, per sampling point, as one Table.
+
+    `statistics` are names from `compute.aggregate.STATISTICS`. Frames are
+    decoded as in `stack_frames` and folded into running statistics one at a
+    time, so memory depends on the size of a frame, not on their number; the
+    median is an estimate (see `compute.aggregate.FrameStatistics`). All
+    frames must sample the same points. With `formulas`, the statistics are
+    of these indices rather than of the spectra, e.g. the maximum NDVI.
+
+    With a single statistic of spectra, columns are named by wavelength,
+    as in a frame's table; otherwise by statistic and wavelength (or index),
+    e.g. "mean 450.0". Metas are the sampling coordinates, and the number
+    of frames is in the table's attributes as `lo_frames`.
+    """
+    with lo_open(filename) as f:
+        positions = range(len(f))[start:stop:step]
+    if not positions:
+        raise ValueError("No frames in the selected range")
+    aggregate = FrameStatistics(statistics)
+    coordinates = engine = None
+    with stage("table.aggregate", frames=len(positions), statistics=statistics):
+        for done, frame in enumerate(decoded_frames(filename, positions, processes,
+                                                    reduction, selection, pool)):
+            if coordinates is None:
+                coordinates, wavelengths = frame.coordinates, frame.wavelengths
+                if formulas:
+                    engine = IndexEngine(wavelengths, formulas)
+            elif not np.array_equal(frame.coordinates, coordinates):
+                raise ValueError("Frames do not sample the same points")
+            aggregate.add(frame.spectra if engine is None else engine(frame.spectra))
+            if callback is not None:
+                callback((done + 1) / len(positions))
+
+        names = engine.names if engine is not None else [f"{w}" for w in wavelengths]
+        if engine is None and len(statistics) == 1:
+            domain = spectra_domain(wavelengths)
+        else:
+            domain = lo_domain([f"{s} {name}" for s in statistics for name in names])
+        X = np.hstack([aggregate.result(s) for s in statistics])
+        table = table_from_arrays(domain, X, metas=coordinates)
+        table.attributes["lo_frames"] = aggregate.n
+        return table
+
+
+def iter_tables(filename: str, start: int = 0, stop: Optional[int] = None,
+                step: int = 1, chunk_rows: Optional[int] = None,
+                processes: int = 0,
+                reduction: Optional[BandReduction] = None,
+                selection: Optional[SampleSelection] = None) -> Iterator[Table]:
+    """Like `iter_frames`, but yield each chunk as a Table with frame metas"""
+    domain = None
+    for chunk in iter_frames(filename, start, stop, step, chunk_rows, processes,
+                             reduction, selection):
+        if domain is None:
+            domain = stacked_domain(chunk.wavelengths)
+        metas = np.empty((len(chunk.spectra), 4), dtype=object)
+        metas[:, :2] = chunk.coordinates
+        metas[:, 2] = chunk.frame
+        metas[:, 3] = chunk.timestamp
+        yield table_from_arrays(domain, chunk.spectra, metas)
@@ -0,0 +1,202 @@
+"""Frame index for Living Optics .lo files.
+
+Listing the frames in a .lo file means walking it with the SDK reader, which
+decodes the scene and spectra of every frame on the way. The index keeps only
+what is needed to address a frame (its number, the position handed to
+``seek()``, its timestamp and number of samples), so that walk happens once
+per file. Indices are
+kept in memory and in Orange's cache directory, keyed on the file's path,
+modification time and size, so an edited or replaced file is re-indexed.
+When following a file that a camera is still writing, a file that has only
+grown is indexed from where its previous index ended.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+from Orange.misc.environ import cache_dir
+
+from ._sdk import lo_open
+
+
+# The SDK reader seeks by frame, so `offset` is the position passed to seek().
+FrameEntry = namedtuple("FrameEntry", ["frame", "offset", "timestamp_s", "timestamp_us", "samples"])
+
+
+def _entry(idx: int, metadata) -> FrameEntry:
+    return FrameEntry(idx, idx, int(metadata.timestamp_s), int(metadata.timestamp_us),
+                      len(metadata.sampling_coordinates))
+
+
+class FrameIndex:
+    """The frames of one .lo file, in file order."""
+    VERSION = 2
+
+    def __init__(self, filename: str, mtime_ns: int, size: int, entries: List[FrameEntry]):
+        self.filename = filename
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.entries = entries
+        self._by_sheet = dict(zip(self.sheets, entries))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, item):
+        return self.entries[item]
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    @property
+    def sheets(self) -> List[str]:
+        """Frame names as shown in the frame drop-downs"""
+        return [f"{e.frame}, {e.timestamp_s}.{e.timestamp_us}" for e in self.entries]
+
+    def entry(self, sheet: str) -> FrameEntry:
+        """Return the entry of the named frame; ValueError if unknown"""
+        try:
+            return self._by_sheet[sheet]
+        except KeyError:
+            raise ValueError(f"{sheet} is not a frame in {self.filename}") from None
+
+    def position(self, sheet: str) -> int:
+        """Return the seek position of the named frame; ValueError if unknown"""
+        return self.entry(sheet).offset
+
+    @classmethod
+    def build(cls, filename: str, callback=None, on_frame=None) -> "FrameIndex":
+        """Walk the file once; `callback` is called with the fraction done.
+
+        `on_frame`, if given, is called with the `FrameEntry` and the
+        (metadata, scene, spectra) of each frame read, e.g. to cache them.
+        """
+        stat = os.stat(filename)
+        entries = []
+        with lo_open(filename) as f:
+            n_frames = len(f)
+            for idx, frame in enumerate(f):
+                entries.append(_entry(idx, frame[0]))
+                if on_frame is not None:
+                    on_frame(entries[-1], frame)
+                if callback is not None:
+                    callback((idx + 1) / n_frames)
+        return cls(filename, stat.st_mtime_ns, stat.st_size, entries)
+
+    def extend(self, callback=None, on_frame=None) -> "FrameIndex":
+        """Index of the file after frames were appended to it.
+
+        Only the last known frame, to check that it is unchanged, and the
+        frames after it are read. If the file was rewritten rather than
+        appended to (it is smaller, has fewer frames, or its last known
+        frame differs or can't be read), it is indexed anew. `callback` and
+        `on_frame` are as for `build`.
+        """
+        stat = os.stat(self.filename)
+        if not self.entries or stat.st_size < self.size:
+            return self.build(self.filename, callback, on_frame)
+        entries = list(self.entries)
+        last = entries[-1]
+        with lo_open(self.filename) as f:
+            n_frames = len(f)
+            if n_frames <= last.frame:
+                return self.build(self.filename, callback, on_frame)
+            try:
+                f.seek(last.offset)
+                unchanged = _entry(last.frame, f.read()[0]) == last
+            except (EOFError, OSError, ValueError):
+                unchanged = False
+            if not unchanged:
+                return self.build(self.filename, callback, on_frame)
+            for idx in range(len(entries), n_frames):
+                frame = f.read()
+                entries.append(_entry(idx, frame[0]))
+                if on_frame is not None:
+                    on_frame(entries[-1], frame)
+                if callback is not None:
+                    callback((idx + 1 - len(self.entries)) / (n_frames - len(self.entries)))
+        return FrameIndex(self.filename, stat.st_mtime_ns, stat.st_size, entries)
+
+    def to_dict(self) -> dict:
+        return {"version": self.VERSION,
+                "filename": self.filename,
+                "mtime_ns": self.mtime_ns,
+                "size": self.size,
+                "frames": [list(e) for e in self.entries]}
+
+    @classmethod
+    def from_dict(cls, state: dict) -> "FrameIndex":
+        if state.get("version") != cls.VERSION:
+            raise ValueError("Unsupported frame index version")
+        return cls(state["filename"], state["mtime_ns"], state["size"],
+                   [FrameEntry(*e) for e in state["frames"]])
+
+
+_indices = {}  # type: Dict[Tuple[str, int, int], FrameIndex]
+_lock = threading.Lock()
+
+
+def _index_path(filename: str) -> str:
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir(), "lo-frame-index", digest + ".json")
+
+
+def _load(filename: str):
+    try:
+        with open(_index_path(filename), encoding="utf-8") as f:
+            index = FrameIndex.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return index if index.filename == filename else None
+
+
+def _save(index: FrameIndex):
+    # The cache is an optimisation; a read-only cache directory is not an error
+    path = _index_path(index.filename)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index.to_dict(), f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def frame_index(filename: str, callback=None, on_frame=None,
+                follow: bool = False) -> FrameIndex:
+    """Return the frame index for `filename`, building it on first use.
+
+    A file changed since it was indexed is indexed anew. With `follow`, for
+    files that a camera is still writing, a file that has grown is instead
+    indexed from where its previous index ended (see `FrameIndex.extend`).
+    `callback` reports progress of the build (see `FrameIndex.build`); it
+    may raise to abandon the build. `on_frame` is called with each frame
+    read to build the index, if any.
+    """
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (filename, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        index = _indices.get(key)
+        previous = next((i for k, i in _indices.items() if k[0] == filename), None)
+    if index is not None:
+        return index
+
+    if previous is None:
+        previous = _load(filename)
+    if previous is not None and (previous.mtime_ns, previous.size) == key[1:]:
+        index = previous
+    else:
+        index = previous.extend(callback, on_frame) if follow and previous is not None \
+            else FrameIndex.build(filename, callback, on_frame)
+        _save(index)
+    with _lock:
+        # Drop indices of earlier versions of the same file
+        for old in [k for k in _indices if k[0] == filename]:
+            del _indices[old]
+        _indices[key] = index
+    return index
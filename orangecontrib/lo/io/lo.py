@@ -6,7 +6,15 @@ import numpy as np
 import datetime
 
 
-from lo.sdk.api.acquisition.io.open import open as lo_open
+from orangecontrib.lo.instrument import logger
+
+from orangecontrib.lo.compute.bands import BandReduction
+from orangecontrib.lo.compute.spectra import SampleSelection
+
+from .cache import read_frame
+from .frames import stack_frames
+from .index import frame_index
+from .tables import spectra_table
 
 
 class LOReader(FileFormat, DataTableMixin):
@@ -17,54 +25,63 @@ class LOReader(FileFormat, DataTableMixin):
     DESCRIPTION = 'Living Optics processed data file'
     SUPPORT_COMPRESSED = False
     SUPPORT_SPARSE_DATA = True
+    # Extra entry in the frames drop-down that reads every frame into one table
+    ALL_FRAMES = "All frames (stacked)"
 
     # We get the filename from the super when instantiated
     def __init__(self, filename):
         super().__init__(filename)
-        print(f"Filename to be loaded is {self.filename}")
+        # Set to True to keep the spectra in a file-backed memory map rather than in RAM
+        self.memmap = False
+        # Wavelength windows, as (start, end) in nm, to crop the spectra to
+        # (None keeps them all), and the number of adjacent bands averaged
+        # into one; both are applied as frames are read
+        self.wavelength_ranges = None
+        self.band_binning = 1
+        # Samples to keep: those within a box (min map_x, min map_y, max map_x,
+        # max map_y; None for all), of those every `sample_stride`-th, and of
+        # those a random `sample_fraction`. Applied before the table is built.
+        self.bounding_box = None
+        self.sample_stride = 1
+        self.sample_fraction = 1.0
+
+    @property
+    def reduction(self):
+        reduction = BandReduction(self.wavelength_ranges, self.band_binning)
+        return None if reduction.is_identity else reduction
+
+    @property
+    def selection(self):
+        selection = SampleSelection(self.bounding_box, self.sample_stride, self.sample_fraction)
+        return None if selection.is_identity else selection
 
     @property
     #This populates a drop-down in the File widget to let you select the frame to view.
     def sheets(self) -> List:
-        # from lo.sdk.api.acquisition.io.open import open as lo_open
-        sheet_list = []
-        with lo_open(self.filename) as f:
-            if len(f) > 1: #This is a file containing more than one frame
-                for idx, frame in enumerate(f):
-                    (metadata, _, _) = frame
-                    sheet_list.append(f"{idx}, {metadata.timestamp_s}.{metadata.timestamp_us}")
-
-        return sheet_list
+        # The frame index is built once per file and cached, rather than walking every frame on each call.
+        index = frame_index(self.filename)
+        if len(index) > 1: #This is a file containing more than one frame
+            return index.sheets + [self.ALL_FRAMES]
+        return []
 
 
     def read(self):
-        # from lo.sdk.api.acquisition.io.open import open as lo_open
-
         # Accommodate .lo files where there are multiple frames:
         # self.sheet is only set if there's >1 frame (?)
+        if self.sheet == self.ALL_FRAMES:
+            return stack_frames(self.filename, memmap=self.memmap,
+                                reduction=self.reduction, selection=self.selection)
         if self.sheet:
-            file_position = self.sheets.index(self.sheet)
-            print(f"{self.sheet}, is at {file_position}")
-            print(f"/n/n SHEETS /n{self.sheets}")
+            file_position = frame_index(self.filename).position(self.sheet)
         else:
             file_position = 0
+        logger.debug("Reading %s, frame at %s", self.filename, file_position)
+
+        (metadata, scene, spectra) = read_frame(self.filename, file_position)
 
-        with lo_open(self.filename) as f:
-            f.seek(file_position)
-            (metadata, scene, spectra) = f.read()
-        print(f"Metadata = {metadata}")
-
-
-        #Needs to return a data_table(data, headers). Headers are the wavelength results.
-        # Build a Domain to describe the spectra data
-        # 
-        my_domain = []
-        for w in metadata.wavelengths:
-            my_domain.append(ContinuousVariable(f"{w}"))
-        
-        domain = Domain(my_domain, metas=[ContinuousVariable("map_x"), ContinuousVariable("map_y")])
-        data = Table.from_numpy(domain, spectra, metas=metadata.sampling_coordinates)
-        return data
+        # Spectra stay in the SDK's float32 buffer; see tables.py for the copies made
+        return spectra_table(metadata, spectra, memmap=self.memmap,
+                             reduction=self.reduction, selection=self.selection)
 
 if __name__ == "__main__":
     #FileFormat.readers['.hea'] = HDRReader_WFDB
@@ -0,0 +1,111 @@
+"""Orange reader for .lo files converted by `lo-convert` (see io.convert).
+
+Opening converted frames needs neither the SDK nor decoding, only loading
+the frame's archive.
+"""
+import json
+import os
+from collections import namedtuple
+from typing import List, Optional
+
+import numpy as np
+
+from Orange.data import FileFormat
+from Orange.data.io_base import DataTableMixin
+
+from orangecontrib.lo.compute.bands import BandReduction
+from orangecontrib.lo.compute.spectra import SampleSelection, stack_spectra
+
+from .index import FrameEntry, FrameIndex
+from .tables import spectra_domain, stacked_domain, table_from_arrays
+
+
+MANIFEST_EXTENSION = ".lonpz"
+MANIFEST_VERSION = 1
+
+
+def frames_dir(manifest: str) -> str:
+    return manifest + ".d"
+
+
+def frame_file(manifest: str, frame: int) -> str:
+    return os.path.join(frames_dir(manifest), f"{frame:06d}.npz")
+
+
+_Frame = namedtuple("_Frame", ["frame", "timestamp", "wavelengths", "coordinates", "spectra"])
+
+
+def load_manifest(filename: str) -> FrameIndex:
+    """The frames listed in a .lonpz manifest, as a FrameIndex"""
+    with open(filename, encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{filename} was written by an unsupported version of lo-convert")
+    stat = os.stat(filename)
+    return FrameIndex(filename, stat.st_mtime_ns, stat.st_size,
+                      [FrameEntry(*e) for e in state["frames"]])
+
+
+def load_frame(manifest: str, entry: FrameEntry,
+               reduction: Optional[BandReduction] = None,
+               selection: Optional[SampleSelection] = None) -> _Frame:
+    with np.load(frame_file(manifest, entry.frame)) as archive:
+        spectra, wavelengths = archive["spectra"], archive["wavelengths"]
+        coordinates = archive["coordinates"]
+    if selection is not None:
+        coordinates, spectra = selection(coordinates, spectra)
+    if reduction is not None:
+        spectra, wavelengths = reduction(spectra, wavelengths)
+    return _Frame(entry.frame, entry.timestamp_s + entry.timestamp_us * 1e-6,
+                  wavelengths, coordinates, spectra)
+
+
+class LONpzReader(FileFormat, DataTableMixin):
+    """Read Living Optics frames converted to NumPy archives"""
+    EXTENSIONS = (MANIFEST_EXTENSION,)
+    DESCRIPTION = 'Living Optics converted frames'
+    SUPPORT_COMPRESSED = False
+    SUPPORT_SPARSE_DATA = False
+    ALL_FRAMES = "All frames (stacked)"
+
+    def __init__(self, filename):
+        super().__init__(filename)
+        # As in LOReader
+        self.wavelength_ranges = None
+        self.band_binning = 1
+        self.bounding_box = None
+        self.sample_stride = 1
+        self.sample_fraction = 1.0
+
+    @property
+    def reduction(self):
+        reduction = BandReduction(self.wavelength_ranges, self.band_binning)
+        return None if reduction.is_identity else reduction
+
+    @property
+    def selection(self):
+        selection = SampleSelection(self.bounding_box, self.sample_stride, self.sample_fraction)
+        return None if selection.is_identity else selection
+
+    @property
+    def sheets(self) -> List:
+        # The same frame names as LOReader, so workflows can switch between the two
+        index = load_manifest(self.filename)
+        if len(index) > 1:
+            return index.sheets + [self.ALL_FRAMES]
+        return []
+
+    def read(self):
+        index = load_manifest(self.filename)
+        reduction, selection = self.reduction, self.selection
+        if self.sheet == self.ALL_FRAMES:
+            X, metas, wavelengths = stack_spectra(
+                (load_frame(self.filename, e, reduction, selection) for e in index),
+                sum(e.samples for e in index) if selection is None else None,
+                metas_dtype=object)
+            return table_from_arrays(stacked_domain(wavelengths), X, metas)
+        # As in LOReader, an unknown frame is an error rather than the first frame
+        entry = index.entry(self.sheet) if self.sheet else index[0]
+        frame = load_frame(self.filename, entry, reduction, selection)
+        return table_from_arrays(spectra_domain(frame.wavelengths), frame.spectra,
+                                 metas=frame.coordinates)
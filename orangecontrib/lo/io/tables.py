@@ -0,0 +1,175 @@
+"""Orange Tables from decoded .lo frames.
+
+Copies between disk and the Spectra table
+-----------------------------------------
+The SDK decodes a frame's spectra into a single float32 buffer. Orange's
+`Table.from_numpy` would upcast it to float64, doubling the cube, so
+`spectra_table` keeps spectra as float32 and hands the buffer to the table as
+its X unchanged. This gives the following guarantees:
+
+* default: one copy of the cube exists, the SDK's decoded buffer, which the
+  table shares. It is converted (copied once) only if the SDK returns
+  something other than C-contiguous float32.
+* ``memmap=True``: the cube is copied once into a file-backed temporary
+  memory map, which the OS can page out; the SDK buffer can then be freed
+  (the frame cache keeps it only within its budget).
+* with a band ``reduction`` (cropping, binning) or a sample ``selection``:
+  the table holds a new, smaller array of just the wavelengths and samples
+  kept; the SDK buffer is not shared.
+
+The sampling coordinates are copied once into the table's metas, as Orange
+keeps metas in an object array; they are two values per sample.
+"""
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from Orange.data import ContinuousVariable, Domain, Table, TimeVariable, Variable
+
+from orangecontrib.lo.compute.bands import BandReduction, SpectralAxis
+from orangecontrib.lo.compute.image import preview_array
+from orangecontrib.lo.compute.spectra import SampleSelection, spectra_array
+from orangecontrib.lo.instrument import stage
+
+
+def table_from_arrays(domain: Domain, X: np.ndarray, metas=None) -> Table:
+    """Like `Table.from_numpy`, but use X as it is, without upcasting it"""
+    metas = np.empty((len(X), 0)) if metas is None else metas
+    table = Table.from_numpy(Domain([], metas=domain.metas),
+                             np.empty((len(X), 0)), metas=metas)
+    with table.unlocked_reference():
+        table.domain = domain
+        table.X = X
+    return table
+
+
+# The reader's metas with more than a name; all other variables named in
+# lo_domain, including attributes called "frame", are plain ContinuousVariables
+_READER_METAS = {
+    "frame": lambda: ContinuousVariable("frame", number_of_decimals=0),
+    "timestamp": lambda: TimeVariable("timestamp", have_date=1, have_time=1),
+}
+
+# The registries are bounded, since widgets also key domains on their inputs'
+# variables; least recently used entries are dropped first
+MAX_VARIABLES = 4096
+MAX_DOMAINS = 64
+_variables = OrderedDict()  # type: OrderedDict[tuple, Variable]
+_domains = OrderedDict()  # type: OrderedDict[tuple, Domain]
+_registry_lock = threading.Lock()
+
+
+def _cached(registry: OrderedDict, size: int, key, create):
+    # Call with _registry_lock held
+    value = registry.get(key)
+    if value is None:
+        value = registry[key] = create()
+        while len(registry) > size:
+            registry.popitem(last=False)
+    else:
+        registry.move_to_end(key)
+    return value
+
+
+def _variable(name: str, meta: bool = False) -> Variable:
+    special = _READER_METAS.get(name) if meta else None
+    return _cached(_variables, MAX_VARIABLES, (name, special is not None),
+                   special or (lambda: ContinuousVariable(name)))
+
+
+def lo_domain(attributes: Iterable[Union[str, Variable]],
+              metas: Iterable[Union[str, Variable]] = ("map_x", "map_y")) -> Domain:
+    """Return the shared Domain with the given attributes and metas.
+
+    Names stand for the add-on's own variables (wavelengths, map_x, frame,
+    ...), which are created once per process; variables are used as they
+    are. Every frame with the same wavelengths thus gets the same Domain
+    object, and Orange's conversions between domains, which are cached per
+    pair of domains, are derived once rather than for every frame. The
+    most recently used MAX_DOMAINS domains are kept; a camera has few
+    wavelength sets.
+    """
+    key = tuple(("var", v) if isinstance(v, Variable) else ("name", str(v))
+                for v in attributes), \
+        tuple(("var", v) if isinstance(v, Variable) else ("name", str(v)) for v in metas)
+    with _registry_lock:
+        return _cached(_domains, MAX_DOMAINS, key, lambda: Domain(
+            [v if isinstance(v, Variable) else _variable(str(v)) for v in attributes],
+            metas=[v if isinstance(v, Variable) else _variable(str(v), meta=True)
+                   for v in metas]))
+
+
+def spectra_domain(wavelengths) -> Domain:
+    return lo_domain([f"{w}" for w in wavelengths])
+
+
+def stacked_domain(wavelengths) -> Domain:
+    """Spectra domain with the frame number and timestamp of each row"""
+    return lo_domain([f"{w}" for w in wavelengths],
+                     metas=("map_x", "map_y", "frame", "timestamp"))
+
+
+_axes = weakref.WeakKeyDictionary()  # type: weakref.WeakKeyDictionary[Domain, SpectralAxis]
+_axes_lock = threading.Lock()
+
+
+def spectral_axis(domain: Domain) -> SpectralAxis:
+    """The wavelengths of a spectra domain, parsed from its attribute names.
+
+    Axes are shared by every widget and kept as long as the domain is, so
+    wavelengths are parsed, and band windows resolved, once per domain.
+    ValueError if an attribute name is not a wavelength.
+    """
+    with _axes_lock:
+        axis = _axes.get(domain)
+    if axis is None:
+        try:
+            axis = SpectralAxis([float(var.name) for var in domain.attributes])
+        except ValueError:
+            raise ValueError("Data does not contain Living Optics spectra") from None
+        with _axes_lock:
+            axis = _axes.setdefault(domain, axis)
+    return axis
+
+
+def spectra_table(metadata, spectra: np.ndarray, memmap: bool = False,
+                  reduction: Optional[BandReduction] = None,
+                  selection: Optional[SampleSelection] = None) -> Table:
+    """Table with a row per sampling point and a column per wavelength.
+
+    With `selection`, only the selected samples are kept, and with
+    `reduction`, their spectra are cropped and binned; the table then holds
+    only what is kept (see `compute.spectra.SampleSelection` and
+    `compute.bands.BandReduction`).
+    """
+    with stage("table.spectra", nbytes=spectra.nbytes, memmap=memmap):
+        wavelengths = metadata.wavelengths
+        coordinates = metadata.sampling_coordinates
+        if selection is not None:
+            coordinates, spectra = selection(coordinates, spectra)
+        if reduction is not None:
+            spectra, wavelengths = reduction(spectra, wavelengths)
+        return table_from_arrays(spectra_domain(wavelengths),
+                                 spectra_array(spectra, memmap),
+                                 metas=coordinates)
+
+
+def preview_domain(width: int) -> Domain:
+    """Domain of preview images `width` pixels wide, shared by all frames"""
+    return lo_domain([f"{y}" for y in range(width)], metas=())
+
+
+def preview_table(scene: np.ndarray, scale: int = 1) -> Table:
+    """Table with the preview image, a column per image column.
+
+    The image is downscaled by `scale` (see `compute.image.preview_array`),
+    which is recorded in the table's attributes as "lo_preview_scale".
+    """
+    with stage("table.preview", nbytes=scene.nbytes, scale=scale):
+        image = preview_array(scene, scale)
+        table = table_from_arrays(preview_domain(image.shape[1]), image)
+        table.attributes["lo_preview_scale"] = scale
+        return table
@@ -0,0 +1,104 @@
+"""Following .lo files while a camera writes them.
+
+`newest_file` finds the file a camera is writing to in a folder, and a
+`FrameWindow` keeps the last frames of a file as it grows. Each update
+indexes only the frames appended since the last one (see
+`index.frame_index`) and decodes only frames it doesn't hold yet, so a
+monitoring workflow never re-reads what it has already seen.
+"""
+import os
+from typing import List, Optional
+
+from Orange.data import Table
+
+from orangecontrib.lo.compute.bands import BandReduction
+from orangecontrib.lo.compute.spectra import SampleSelection, stack_spectra
+from orangecontrib.lo.instrument import count
+
+from .cache import FrameCache
+from .frames import FrameChunk, _decoded
+from .index import FrameEntry, frame_index
+from .tables import stacked_domain, table_from_arrays
+
+
+def newest_file(folder: str, extensions=(".lo",)) -> Optional[str]:
+    """The most recently modified file in `folder` with one of `extensions`"""
+    newest, newest_mtime = None, None
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.name.lower().endswith(extensions):
+            continue
+        try:
+            mtime = entry.stat().st_mtime_ns
+        except OSError:
+            continue  # removed in the meantime
+        if newest_mtime is None or mtime > newest_mtime:
+            newest, newest_mtime = entry.path, mtime
+    return newest
+
+
+class FrameWindow:
+    """The last `size` frames of a file, kept up to date as the file grows.
+
+    Frames are read through `cache`, which also receives the frames decoded
+    to index them, so each new frame is decoded once; it is then selected
+    and reduced once and kept in that form.
+    """
+    def __init__(self, size: int = 1, cache: Optional[FrameCache] = None,
+                 reduction: Optional[BandReduction] = None,
+                 selection: Optional[SampleSelection] = None):
+        self.size = max(1, size)
+        self.cache = cache if cache is not None else FrameCache()
+        self.reduction = reduction
+        self.selection = selection
+        self.filename = None
+        self.entries = []  # type: List[FrameEntry]
+        self._chunks = {}  # frame number -> FrameChunk
+
+    def update(self, filename: str, callback=None) -> bool:
+        """Catch up with `filename`; True if there are new frames.
+
+        Switching to another file starts the window anew. `callback` reports
+        the progress of indexing (see `index.frame_index`).
+        """
+        filename = os.path.abspath(filename)
+        if filename != self.filename:
+            self.filename, self.entries, self._chunks = filename, [], {}
+        # Indexing new frames decodes them; they are cached, so the window's
+        # frames, usually among them, are not decoded again below
+        def keep(entry, frame):
+            self.cache.put(filename, entry, frame)
+
+        entries = frame_index(filename, callback, on_frame=keep, follow=True).entries[-self.size:]
+        if entries == self.entries:
+            return False
+        kept = {e.frame for e in entries}
+        self._chunks = {frame: chunk for frame, chunk in self._chunks.items() if frame in kept}
+        for entry in entries:
+            if entry.frame in self._chunks:
+                count("watch.kept")
+                continue
+            count("watch.read")
+            metadata, _, spectra = self.cache.get(filename, entry)
+            frame = _decoded(entry.offset, metadata, spectra, self.reduction, self.selection)
+            self._chunks[entry.frame] = FrameChunk(
+                entry.frame, frame.timestamp, slice(0, len(frame.spectra)),
+                frame.wavelengths, frame.coordinates, frame.spectra)
+        self.entries = entries
+        return True
+
+    @property
+    def newest(self) -> Optional[FrameEntry]:
+        return self.entries[-1] if self.entries else None
+
+    def table(self, memmap: bool = False) -> Optional[Table]:
+        """The frames in the window stacked into one table, with frame metas"""
+        if not self.entries:
+            return None
+        chunks = [self._chunks[e.frame] for e in self.entries]
+        X, metas, wavelengths = stack_spectra(
+            chunks, sum(len(c.spectra) for c in chunks), memmap, metas_dtype=object)
+        return table_from_arrays(stacked_domain(wavelengths), X, metas)
@@ -1,4 +1,8 @@
 import sysconfig
+
+# Registers the .lo readers with Orange when the widgets are loaded
+from orangecontrib.lo.io.lo import LOReader  # pylint: disable=unused-import
+from orangecontrib.lo.io.lonpz import LONpzReader  # pylint: disable=unused-import
 # Category metadata.
 
 # Category icon show in the menu
@@ -1,9 +1,15 @@
-from Orange.data import Table, Domain, ContinuousVariable
+from AnyQt.QtCore import QRectF, QTimer
+
+from Orange.data import Table
 from Orange.widgets import gui
 from Orange.widgets.settings import Setting
 from Orange.widgets.widget import OWWidget, Input, Output, Msg
 
+from orangecontrib.lo.compute.indices import BAND_RATIO, INDICES, Formula, IndexEngine
+from orangecontrib.lo.compute.overlay import PointRaster, colour_levels, points_in
+from orangecontrib.lo.io.tables import lo_domain, spectral_axis, table_from_arrays
 import numpy as np
+import pyqtgraph as pg
 
 class LOImageViewer(OWWidget):
     # Widget needs a name, or it is considered an abstract widget
@@ -13,9 +19,7 @@ class LOImageViewer(OWWidget):
     icon = "icons/mywidget.svg"
     priority = 60  # where in the widget order it will appear
     keywords = ["widget", "data"]
-    want_main_area = False
-    resizing_enabled = False
-    
+    graph_name = "plot_widget"
 
     class Inputs:
         # specify the name of the input and the type
@@ -25,75 +29,201 @@ class LOImageViewer(OWWidget):
     class Outputs:
         # if there are two or more outputs, default=True marks the default output
         out_data = Output("Data", Table, default=True)
-    
-   
+
+    band1_start = Setting("650")
+    band1_end = Setting("680")
+    band2_start = Setting("785")
+    band2_end = Setting("900")
+    # The band ratio, a standard index or a wavelength (the name of its column)
+    colour_by = Setting(BAND_RATIO.name)
+    overlay_opacity = Setting(80)
+
+    # The samples are drawn as a raster of cells (see compute.overlay), and as
+    # markers once the view is zoomed in to at most this many samples
+    MAX_POINTS = 10000
+    POINT_SIZE = 7
+    # Markers are updated when the view stops changing for this long
+    LOD_DELAY_MS = 15
+    COLOUR_MAP = "viridis"
+
     # same class can be initiated for Error and Information messages
     class Warning(OWWidget.Warning):
         warning = Msg("My warning!")
 
+    class Error(OWWidget.Error):
+        invalid_bands = Msg("{}")
+        no_coordinates = Msg("Data has no sampling coordinates (map_x, map_y)")
+
     def __init__(self):
         super().__init__()
         self.spectra = None
         self.scene = None
-        # self.label_box = gui.comboBox(
-        #     self.controlArea, 
-        #     self, 
-        #     "upsample_dimension",
-        #     label="Select Target Output Size", 
-        #     items=("1920", "960", "640", "480"),
-        #     sendSelectedValue=True,
-        #     callback=self.commit
-        # )
-    
+        self.out_data = None
+        # View x, y of the samples: as in UpsampleLO, map_x runs along the
+        # scene's rows and map_y along its columns
+        self.points = None
+        self.raster = None
+        self.values = None
+        self.levels = (0.0, 1.0)
+        # Band means of the spectra per wavelength window, shared by the indices
+        self.band_means = {}
+        self.colour_items = []
+
+        self.colour_combo = gui.comboBox(
+            self.controlArea, self, "colour_by", box="Colour samples by",
+            sendSelectedValue=True, callback=self.commit)
+        box = gui.vBox(self.controlArea, "Band ratio")
+        for attr, label in (("band1_start", "Band 1 start wavelength"),
+                            ("band1_end", "Band 1 end wavelength"),
+                            ("band2_start", "Band 2 start wavelength"),
+                            ("band2_end", "Band 2 end wavelength")):
+            gui.lineEdit(box, self, attr, label=label, callback=self.commit)
+        gui.button(box, self, label="Reset Band Limits",
+                   callback=self.reset_limits, default=False, autoDefault=False)
+        gui.hSlider(self.controlArea, self, "overlay_opacity", box="Overlay opacity",
+                    minValue=0, maxValue=100, callback=self.update_opacity)
+        gui.rubber(self.controlArea)
+
+        self.plot_widget = pg.PlotWidget(background="w")
+        self.mainArea.layout().addWidget(self.plot_widget)
+        view = self.plot_widget.getViewBox()
+        view.setAspectLocked(True)
+        view.invertY(True)  # rows go down, as in the scene
+        self.scene_item = pg.ImageItem(axisOrder="row-major")
+        self.overlay_item = pg.ImageItem(axisOrder="row-major")
+        self.scatter = pg.ScatterPlotItem(pen=None, size=self.POINT_SIZE, pxMode=True)
+        for z, item in enumerate((self.scene_item, self.overlay_item, self.scatter)):
+            item.setZValue(z)
+            self.plot_widget.addItem(item)
+        self.lut = pg.colormap.get(self.COLOUR_MAP).getLookupTable(nPts=256, alpha=True)
+        self.brushes = np.array([pg.mkBrush(*colour) for colour in self.lut], dtype=object)
+        self.update_opacity()
+
+        self.lod_timer = QTimer(self, singleShot=True, interval=self.LOD_DELAY_MS)
+        self.lod_timer.timeout.connect(self.update_points)
+        view.sigRangeChanged.connect(lambda *_: self.lod_timer.start())
 
     @Inputs.spectra
     def set_data(self, in_data):
-        if in_data is not None: 
-            self.in_data = in_data
-            # extract the sampling_coordinates from the metadata on self.data
-            sampling_coordinates = in_data.metas #since that's the coordinates in the LO data, unless we go and mess that up somewhere else. 
-            band1_start = int(self.band1_start)
-            band1_end = int(self.band1_end)
-            band2_start = int(self.band2_start)
-            band2_end = int(self.band2_end)
-
-            wavelengths = np.array([float(var.name) for var in in_data.domain.variables])
-            ndvi_list_a= calculate_NDVI(
-                in_data.X, 
-                wavelengths, 
-                (band1_start, band1_end), 
-                (band2_start, band2_end)
-            )
-            ndvi_list = np.array([ndvi_list_a, ndvi_list_a]) #Hack to make the data 2D
-            # Convert the domain from one containing spectra to one containing a single number per point.
-            # First build a new domain           
-            my_domain = [ContinuousVariable("Band Ratio"), ContinuousVariable("Band Ratio 2")]
-            domain = Domain(my_domain, metas=[ContinuousVariable("map_x"), ContinuousVariable("map_y")])
-
-            #Then transfer data into it
-            print(f"Shape of ndvi data is {ndvi_list.shape}")
-            #TODO: Confirm whether this needs to be 'self.data' or just plain old 'data'. Might be the source of the errors. 
-            self.out_data = Table.from_numpy(domain, ndvi_list.T, metas=sampling_coordinates)  
+        self.spectra = in_data
+        self.band_means = {}
+        fresh = self.raster is None
+        self.points = self.raster = None
+        self.Error.no_coordinates.clear()
+        self.colour_items = []
+        if in_data is not None:
+            domain = in_data.domain
+            self.colour_items = [BAND_RATIO.name, *INDICES, *(var.name for var in domain.attributes)]
+            if "map_x" in domain and "map_y" in domain:
+                self.points = np.column_stack((in_data.get_column("map_y"),
+                                               in_data.get_column("map_x"))).astype(float)
+                try:
+                    self.raster = PointRaster(self.points)
+                except ValueError:
+                    self.points = None
+            if self.raster is None:
+                self.Error.no_coordinates()
+        self.colour_combo.clear()
+        self.colour_combo.addItems(self.colour_items)
+        if self.colour_items and self.colour_by not in self.colour_items:
+            self.colour_by = BAND_RATIO.name
+        self.colour_by = self.colour_by  # selects it in the rebuilt combo
+        self.commit()
+        if fresh and self.raster is not None:
+            self.plot_widget.getViewBox().autoRange()
+
+    @Inputs.scene
+    def set_scene(self, scene):
+        self.scene = scene
+        if scene is None or not len(scene):
+            self.scene_item.clear()
+            return
+        # The preview may be downscaled; it is drawn in full-size scene pixels
+        scale = scene.attributes.get("lo_preview_scale", 1)
+        image = scene.X
+        self.scene_item.setImage(image, autoLevels=True)
+        self.scene_item.setRect(QRectF(0, 0, image.shape[1] * scale, image.shape[0] * scale))
+        if self.raster is None:
+            self.plot_widget.getViewBox().autoRange()
+
+    def colour_values(self):
+        """The value of each sample for the chosen colouring"""
+        X = self.spectra.X
+        if self.colour_by == BAND_RATIO.name:
+            engine = IndexEngine(
+                spectral_axis(self.spectra.domain),
+                [BAND_RATIO],
+                {"b1": (float(self.band1_start), float(self.band1_end)),
+                 "b2": (float(self.band2_start), float(self.band2_end))})
+        elif self.colour_by in INDICES:
+            engine = IndexEngine(spectral_axis(self.spectra.domain),
+                                 [Formula(self.colour_by, INDICES[self.colour_by])])
         else:
-            self.out_data = None
-        self.Outputs.out_data.send(self.out_data)
-    
+            return np.ascontiguousarray(X[:, self.spectra.domain.index(self.colour_by)])
+        # Band means already computed for this input (e.g. for a previous index) are reused
+        return engine(X, self.band_means)[:, 0]
+
     def reset_limits(self):
         #Reset the band start and stop values to their default (NDVI values)
         self.band1_start = "650"
-        self.band1_end = "850"
+        self.band1_end = "680"
         self.band2_start = "785"
         self.band2_end = "900"
-        self.commit() 
+        self.commit()
 
     def commit(self):
-        self.set_data(self.spectra, self.scene) #Update the contents.
+        self.Error.invalid_bands.clear()
+        self.values = self.out_data = None
+        if self.spectra is not None:
+            try:
+                self.values = self.colour_values()
+            except ValueError as ex:
+                self.Error.invalid_bands(str(ex))
+            else:
+                self.levels = colour_levels(self.values)
+                domain = lo_domain([self.colour_by], metas=self.spectra.domain.metas)
+                self.out_data = table_from_arrays(domain, self.values[:, None],
+                                                  metas=self.spectra.metas)
+        self.update_overlay()
         self.Outputs.out_data.send(self.out_data)
 
-    
+    def update_overlay(self):
+        if self.values is None or self.raster is None:
+            self.overlay_item.clear()
+            self.scatter.clear()
+            return
+        self.overlay_item.setImage(self.raster.image(self.values), lut=self.lut,
+                                   levels=self.levels, autoLevels=False)
+        self.overlay_item.setRect(QRectF(*self.raster.extent))
+        self.update_points()
+
+    def update_points(self):
+        """Draw the visible samples as markers if there are few enough of them"""
+        self.lod_timer.stop()
+        if self.values is None or self.points is None:
+            return
+        (x0, x1), (y0, y1) = self.plot_widget.getViewBox().viewRange()
+        visible = points_in(self.points, x0, y0, x1, y1)
+        zoomed_in = len(visible) <= self.MAX_POINTS
+        self.overlay_item.setVisible(not zoomed_in)
+        self.scatter.setVisible(zoomed_in)
+        if not zoomed_in:
+            return
+        values = self.values[visible]
+        known = np.isfinite(values)
+        visible, values = visible[known], values[known]
+        low, high = self.levels
+        colours = np.clip((values - low) * (255 / (high - low)), 0, 255).astype(int)
+        self.scatter.setData(x=self.points[visible, 0], y=self.points[visible, 1],
+                             brush=self.brushes[colours])
+
+    def update_opacity(self):
+        self.overlay_item.setOpacity(self.overlay_opacity / 100)
+        self.scatter.setOpacity(self.overlay_opacity / 100)
+
     def send_report(self):
-        # self.report_plot() includes visualizations in the report
-        self.report_caption(self.label)
+        self.report_items((("Colour", self.colour_by),))
+        self.report_plot()
 
 
 if __name__ == "__main__":
@@ -1,16 +1,21 @@
+from AnyQt.QtCore import QTimer
+from AnyQt.QtWidgets import QListView
+
 from Orange.data import Table, Domain, ContinuousVariable
 from Orange.widgets import gui
 from Orange.widgets.settings import Setting
 from Orange.widgets.widget import OWWidget, Input, Output, Msg
 
-from lo.sdk.api.analysis.overlays import NDVI as calculate_NDVI
+from orangecontrib.lo.compute.indices import (
+    BAND_RATIO, BANDS, INDICES, Formula, IndexEngine, parse_formulas)
+from orangecontrib.lo.io.tables import lo_domain, spectral_axis, table_from_arrays
 import numpy as np
 
 class NDVI(OWWidget):
     # Widget needs a name, or it is considered an abstract widget
     # and not shown in the menu.
     name = "Calculate NDVI"
-    description = "Calculate NDVI (or band ratios) from a list of spectra"
+    description = "Calculate NDVI, band ratios and other spectral indices from a list of spectra"
     icon = "icons/ndvi.svg"
     priority = 100  # where in the widget order it will appear
     keywords = ["widget", "data"]
@@ -28,48 +33,45 @@ class NDVI(OWWidget):
     
     #Enable the user to set the bands so it's not just NDVI that's possible.
     band1_start = Setting("650")
-    band1_end = Setting("655")
-    band2_start = Setting("675")
-    band2_end = Setting("680")
+    band1_end = Setting("680")
+    band2_start = Setting("785")
+    band2_end = Setting("900")
+    # Standard indices to add, as rows of the list, and "name = formula" lines
+    # over the bands in BANDS and b1, b2
+    selected_indices = Setting([])
+    custom_formulas = Setting("")
+    auto_commit = Setting(True)
+
+    # Typing in the band and formula fields recomputes only after a pause this long
+    EDIT_DELAY_MS = 400
   
     # same class can be initiated for Error and Information messages
     class Warning(OWWidget.Warning):
         warning = Msg("My warning!")
 
+    class Error(OWWidget.Error):
+        invalid_indices = Msg("{}")
+
     def __init__(self):
         super().__init__()
         self.in_data = None
-        self.band1_start = gui.lineEdit(
-            self.controlArea, 
-            self, 
-            "band1_start", 
-            label="Band 1 start wavelength", 
-            callback=self.commit
-        )
-
-        self.band1_end = gui.lineEdit(
-            self.controlArea, 
-            self, 
-            "band1_end", 
-            label="Band 1 end wavelength", 
-            callback=self.commit
-        )
-
-        self.band2_start = gui.lineEdit(
-            self.controlArea, 
-            self, 
-            "band2_start", 
-            label="Band 2 start wavelength", 
-            callback=self.commit
-        )
-
-        self.band2_end = gui.lineEdit(
-            self.controlArea, 
-            self, 
-            "band2_end", 
-            label="Band 2 end wavelength", 
-            callback=self.commit
-        )
+        self.out_data = None
+        # Band means of in_data per wavelength window, so that editing a band
+        # recomputes only that band
+        self.band_means = {}
+        # What the last output was computed from (see IndexEngine.key)
+        self.sent_key = None
+        self.index_names = list(INDICES)
+
+        self.edit_timer = QTimer(self, singleShot=True, interval=self.EDIT_DELAY_MS)
+        self.edit_timer.timeout.connect(self.bands_changed)
+
+        for attr, label in (("band1_start", "Band 1 start wavelength"),
+                            ("band1_end", "Band 1 end wavelength"),
+                            ("band2_start", "Band 2 start wavelength"),
+                            ("band2_end", "Band 2 end wavelength")):
+            gui.lineEdit(self.controlArea, self, attr, label=label,
+                         callback=self.edit_timer.start, callbackOnType=True)
 
         self.reset_limits_button = gui.button(
             self.controlArea, 
@@ -80,50 +82,61 @@ class NDVI(OWWidget):
             autoDefault=False
         )
 
-        self.reset_limits() #Run this to set the values to their defaults when the widget is instantiated.
-
-        # self.label_box = gui.comboBox(
-        #     self.controlArea, 
-        #     self, 
-        #     "upsample_dimension",
-        #     label="Select Target Output Size", 
-        #     items=("1920", "960", "640", "480"),
-        #     sendSelectedValue=True,
-        #     callback=self.commit
-        # )
-    
+        gui.listBox(
+            self.controlArea,
+            self,
+            "selected_indices",
+            labels="index_names",
+            box="Also compute",
+            selectionMode=QListView.MultiSelection,
+            callback=self.bands_changed
+        )
+
+        gui.lineEdit(
+            self.controlArea,
+            self,
+            "custom_formulas",
+            label="Custom indices (name = formula; ...)",
+            callback=self.edit_timer.start,
+            callbackOnType=True,
+            tooltip="Formulas over b1, b2 and " + ", ".join(
+                f"{name} ({start}-{end} nm)" for name, (start, end) in BANDS.items())
+        )
+
+        gui.auto_commit(self.buttonsArea, self, "auto_commit", "Apply")
 
     @Inputs.in_data
     def set_data(self, in_data):
-        if in_data is not None: 
-            self.in_data = in_data
-            # extract the sampling_coordinates from the metadata on self.data
-            sampling_coordinates = in_data.metas #since that's the coordinates in the LO data, unless we go and mess that up somewhere else. 
-            band1_start = int(self.band1_start)
-            band1_end = int(self.band1_end)
-            band2_start = int(self.band2_start)
-            band2_end = int(self.band2_end)
-
-            wavelengths = np.array([float(var.name) for var in in_data.domain.variables])
-            ndvi_list_a= calculate_NDVI(
-                in_data.X, 
-                wavelengths, 
-                (band1_start, band1_end), 
-                (band2_start, band2_end)
-            )
-            ndvi_list = np.array([ndvi_list_a, ndvi_list_a]) #Hack to make the data 2D
-            # Convert the domain from one containing spectra to one containing a single number per point.
-            # First build a new domain           
-            my_domain = [ContinuousVariable("Band Ratio"), ContinuousVariable("Band Ratio 2")]
-            domain = Domain(my_domain, metas=[ContinuousVariable("map_x"), ContinuousVariable("map_y")])
-
-            #Then transfer data into it
-            print(f"Shape of ndvi data is {ndvi_list.shape}")
-            #TODO: Confirm whether this needs to be 'self.data' or just plain old 'data'. Might be the source of the errors. 
-            self.out_data = Table.from_numpy(domain, ndvi_list.T, metas=sampling_coordinates)  
-        else:
-            self.out_data = None
-        self.Outputs.out_data.send(self.out_data)
+        self.in_data = in_data
+        self.band_means = {}
+        self.sent_key = None
+        self.commit.now()
+
+    def index_engine(self, domain):
+        bands = dict(BANDS,
+                     b1=(float(self.band1_start), float(self.band1_end)),
+                     b2=(float(self.band2_start), float(self.band2_end)))
+        formulas = [BAND_RATIO]
+        formulas += [Formula(self.index_names[i], INDICES[self.index_names[i]])
+                     for i in self.selected_indices]
+        formulas += parse_formulas(self.custom_formulas)
+        return IndexEngine(spectral_axis(domain), formulas, bands)
+
+    def engine_key(self):
+        if self.in_data is None:
+            return None
+        try:
+            return self.index_engine(self.in_data.domain).key
+        except ValueError:
+            return None
+
+    def bands_changed(self):
+        # Limits that select the same wavelengths (e.g. "78" on the way to
+        # "785") give the same output, which is then not sent again
+        self.edit_timer.stop()
+        key = self.engine_key()
+        if key is None or key != self.sent_key:
+            self.commit.deferred()
     
     def reset_limits(self):
         #Reset the band start and stop values to their default (NDVI values)
@@ -131,10 +144,28 @@ class NDVI(OWWidget):
         self.band1_end = "680"
         self.band2_start = "785"
         self.band2_end = "900"
-        self.commit() 
+        self.bands_changed()
 
+    @gui.deferred
     def commit(self):
-        self.set_data(self.in_data) #Update the contents.
+        self.Error.clear()
+        out_data = key = None
+        if self.in_data is not None:
+            try:
+                engine = self.index_engine(self.in_data.domain)
+            except ValueError as ex:
+                self.Error.invalid_indices(str(ex))
+            else:
+                key = engine.key
+                if key == self.sent_key:
+                    return
+                # One column per index; the metas (sampling coordinates, and any
+                # frame and timestamp) are passed through
+                domain = lo_domain(engine.names, metas=self.in_data.domain.metas)
+                out_data = table_from_arrays(domain, engine(self.in_data.X, self.band_means),
+                                             metas=self.in_data.metas)
+        self.sent_key = key
+        self.out_data = out_data
         self.Outputs.out_data.send(self.out_data)
 
     
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-from AnyQt.QtCore import Qt
+from AnyQt.QtCore import Qt, QTimer
 from AnyQt.QtWidgets import QStyle, QSizePolicy, QFileDialog
 from Orange.data import Table
 from Orange.data import Domain
@@ -8,15 +8,125 @@ from Orange.data import StringVariable, ContinuousVariable
 #from Orange.data import  DiscreteVariable
 from Orange.widgets import gui, settings
 from Orange.widgets.settings import Setting
+from Orange.widgets.utils.concurrent import ConcurrentWidgetMixin, TaskState
 from Orange.widgets.utils.widgetpreview import WidgetPreview
 from Orange.widgets.widget import OWWidget, Msg, Output
 import numpy as np
+import os
 from os import path
-from typing import List
+from types import SimpleNamespace
+from typing import List, Optional
 
-from lo.sdk.api.acquisition.io.open import open as lo_open
+from orangecontrib.lo.compute.bands import BandReduction, parse_windows
+from orangecontrib.lo.compute.spectra import SampleSelection, parse_box
+from orangecontrib.lo.io.cache import FrameCache
+from orangecontrib.lo.io.frames import DecodingPool, aggregate_frames, stack_frames
+from orangecontrib.lo.io.index import frame_index
+from orangecontrib.lo.io.tables import preview_table, spectra_table
+from orangecontrib.lo.io.watch import FrameWindow, newest_file
+from orangecontrib.lo.instrument import logger
 
-class OWLOFileReader(OWWidget):
+
+class Results(SimpleNamespace):
+    sheets = []  # type: List[str]
+    sheet = ""
+    frame = None  # (metadata, scene, spectra) as read by the SDK
+    spectra = None  # type: Optional[Table]
+    preview = None  # type: Optional[Table]
+
+
+def load_lo_file(filename: str, sheet: str, cache: FrameCache,
+                 read_ahead: bool, memmap: bool, state: TaskState,
+                 stack: Optional[slice] = None, preview_scale: int = 1,
+                 reduction: Optional[BandReduction] = None,
+                 selection: Optional[SampleSelection] = None,
+                 statistic: Optional[str] = None,
+                 pool: Optional[DecodingPool] = None) -> Results:
+    """Index the file, read the chosen frame and build the output tables.
+
+    Frames come from `cache` when they were seen or read ahead before; with
+    `read_ahead`, the neighbouring frames are then read in the background.
+    With `memmap`, the spectra are kept in a file-backed memory map.
+    If `stack` is given, the spectra output holds those frames stacked
+    into one table instead of the chosen frame, or, with `statistic`, that
+    statistic of each sample over those frames. The preview is downscaled
+    by `preview_scale`. Only the samples chosen by `selection` are kept, and
+    their spectra are cropped and binned by `reduction`. Long ranges of
+    frames are decoded by the workers of `pool`.
+    Runs in a worker thread; raises if the widget asks for interruption,
+    e.g. because another frame was chosen in the meantime.
+    """
+    def callback(progress):
+        state.set_progress_value(100 * progress)
+        if state.is_interruption_requested():
+            raise InterruptedError
+
+    state.set_status("Indexing frames...")
+    # Building the index is only slow the first time a file is opened
+    index = frame_index(filename, callback=lambda p: callback(0.8 * p))
+    sheets = index.sheets
+    try:
+        current = sheets.index(sheet)
+    except ValueError:
+        #Likely there's stale data in sheet from the previous file. Reset to the first frame
+        current = 0
+        sheet = sheets[0]
+
+    state.set_status("Reading frame...")
+    (metadata, scene, spectra) = cache.get(filename, index[current])
+    if read_ahead:
+        neighbours = index[max(current - 1, 0):current + 2]
+        cache.prefetch(filename, [e for e in neighbours if e.frame != index[current].frame])
+    callback(0.9 if stack is None else 0.3)
+
+    state.set_status("Building tables...")
+    frame = (metadata, scene, spectra)
+    tableA, tableB = OWLOFileReader.create_tables_from_results(
+        frame, memmap, preview_scale, reduction, selection)
+    if stack is not None and statistic is not None:
+        state.set_status("Combining frames...")
+        tableA = aggregate_frames(filename, (statistic,), stack.start, stack.stop, stack.step,
+                                  callback=lambda p: callback(0.3 + 0.7 * p),
+                                  reduction=reduction, selection=selection, pool=pool)
+    elif stack is not None:
+        state.set_status("Stacking frames...")
+        tableA = stack_frames(filename, stack.start, stack.stop, stack.step,
+                              memmap=memmap, callback=lambda p: callback(0.3 + 0.7 * p),
+                              reduction=reduction, selection=selection, pool=pool)
+    callback(1)
+    return Results(sheets=sheets, sheet=sheet, frame=frame,
+                   spectra=tableA, preview=tableB)
+
+
+def follow_lo_file(filename: str, window: FrameWindow, memmap: bool, state: TaskState,
+                   preview_scale: int = 1) -> Optional[Results]:
+    """Catch up with a file that is being written; None if it has no new frames.
+
+    Only frames appended since the last call are indexed, and only frames
+    not yet in `window` are read. The spectra output holds the newest frame,
+    or, for a window of several frames, those frames stacked.
+    """
+    def callback(progress):
+        state.set_progress_value(100 * progress)
+        if state.is_interruption_requested():
+            raise InterruptedError
+
+    state.set_status("Checking for new frames...")
+    if not window.update(filename, callback=callback):
+        return None
+    sheets = frame_index(filename, follow=True).sheets
+    frame = window.cache.get(filename, window.newest)
+    (metadata, scene, spectra) = frame
+    if window.size == 1:
+        tableA = spectra_table(metadata, spectra, memmap=memmap,
+                               reduction=window.reduction, selection=window.selection)
+    else:
+        tableA = window.table(memmap)
+    return Results(sheets=sheets, sheet=sheets[-1], frame=frame,
+                   spectra=tableA, preview=preview_table(scene, preview_scale))
+
+
+class OWLOFileReader(OWWidget, ConcurrentWidgetMixin):
     name = "LO File Loader"
     description = "Opens a Living Optics .lo file to allow reading of the spectral data and preview image"
     icon = "icons/LOFile.svg"
@@ -27,63 +137,67 @@ class OWLOFileReader(OWWidget):
         spectral_data = Output("Spectra", Table)
         preview_data = Output("Preview", Table)
         
+    class Warning(OWWidget.Warning):
+        follow_failed = Msg('Could not read new frames, trying again on the next check: {}')
+
     class Error(OWWidget.Error):
         load_exception = Msg('Exception loading Living Optics processed file: {}')
+        invalid_ranges = Msg('{}')
+        invalid_area = Msg('{}')
+
+    # Ways of combining a range of frames: label and statistic (None stacks them)
+    COMBINE = (("Stacked", None), ("Mean", "mean"), ("Median", "median"),
+               ("Std. deviation", "std"), ("Minimum", "min"), ("Maximum", "max"))
         
     settingsHandler = settings.DomainContextHandler()
     lofile = settings.ContextSetting(None)
     recentFiles = settings.ContextSetting([])
+    cache_size = Setting(512) # Memory budget for decoded frames, in MB
+    read_ahead = Setting(True)
+    memmap_spectra = Setting(False)
+    preview_level = Setting(0) # The preview is downscaled by 2 ** preview_level
+    stack = Setting(False)
+    stack_first = Setting(0)
+    stack_last = Setting(-1) # -1 stands for the last frame in the file
+    stack_step = Setting(1)
+    combine = Setting(0) # index into COMBINE: stack the frames, or a statistic over them
+    # Wavelength ranges to keep, e.g. "450-700; 780-900" (empty keeps all),
+    # and the number of adjacent bands averaged into one
+    wavelength_ranges = Setting("")
+    band_binning = Setting(1)
+    # Samples to keep: an area, "x0, y0, x1, y1" in map_x, map_y (empty keeps
+    # all), every n-th sample of those, and a random percentage of those
+    sample_area = Setting("")
+    sample_stride = Setting(1)
+    sample_percent = Setting(100)
+    # Follow the newest .lo file in a folder as it is written
+    watch = Setting(False)
+    watch_folder = Setting("")
+    watch_interval = Setting(2) # seconds between checks for new files and frames
+    watch_window = Setting(1) # number of newest frames output, stacked if more than one
 
     want_control_area = False
     sheets = 0 #["one", "two", "three"]
     refresh_sheet_list = False #State variable to manage whether we refresh the sheet list (which should only happen when a new file is loaded)
 
     def __init__(self):
-        super().__init__()
+        OWWidget.__init__(self)
+        ConcurrentWidgetMixin.__init__(self)
+        self.frame_cache = FrameCache(self.cache_size * 2 ** 20)
+        # Started only for long ranges of frames, and kept for the next reload
+        self.decoding_pool = DecodingPool()
         self.file_index = 0
         self.results = None
         self.sheet = "" #Default to None unless there are >1 frames in the file. Store the current frame id/name
         self.sheets = [] #["one", "two", "three"] # List of the frames in the file, if relevant
+        self.frame_window = None
+        self.watch_stamp = None # (mtime, size) of the watched file when last followed
+        self.watch_timer = QTimer(self, interval=1000 * self.watch_interval)
+        self.watch_timer.timeout.connect(self.poll_folder)
         self.populate_mainArea()        
         self.populate_comboboxes()
         self.reload()
-    
-    #This populates a drop-down in the File widget to let you select the frame to view.
-    
-    def has_sheets(self) -> List:
-        sheet_list = []
-        with lo_open(self.lofile) as f:
-            # if len(f) > 1: #This is a file containing more than one frame
-            for idx, frame in enumerate(f):
-                (metadata, _, _) = frame
-                sheet_list.append(f"{idx} {metadata.timestamp_s}.{metadata.timestamp_us}")               
-            if self.sheet in ["", "(No Frames)"]: #The logic here is that self.sheet is blank when the class is first instantiated.
-                self.sheet = sheet_list[0] #Set sheet to the first frame if it's uninitialised.
-            self.sheets = sheet_list
-            return True
-        # return False  # didn't find multiple frames in the data 
-
-    def load_lo_file(self):
-        # Accommodate .lo files where there are multiple frames:
-        # self.sheet is only set if there's >1 frame
-        self.has_sheets()
-        if self.sheets:
-            try:
-                file_position = self.sheets.index(self.sheet)
-            except(ValueError):
-                #Likely there's stale data in self.sheet from the previous file. Reset to the first frame
-                file_position = 0
-                self.sheet = self.sheets[0]
-        else:
-            file_position = 0
-
-        with lo_open(self.lofile) as f:
-            f.seek(file_position)
-            (metadata, scene, spectra) = f.read()
-            self.results = (metadata, scene, spectra)
-        print(f"Metadata = {metadata}")
-        self.populate_comboboxes()
-
+        self.watch_changed()
 
     def populate_mainArea(self):
         hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
@@ -103,33 +217,247 @@ class OWLOFileReader(OWWidget):
             sizePolicy=(QSizePolicy.Maximum, QSizePolicy.Fixed)
         )
 
-    def create_tables_from_results(self):
-        if not self.results: return
-        #Needs to return a data_table(data, headers). Headers are the wavelength results.
-        # Build a Domain to describe the spectra data
-        (metadata, scene, spectra) = self.results
-        my_domain = []
-        for w in metadata.wavelengths:
-            my_domain.append(ContinuousVariable(f"{w}"))
-        domain = Domain(my_domain, metas=[ContinuousVariable("map_x"), ContinuousVariable("map_y")])
-        tableA = Table.from_numpy(domain, spectra, metas=metadata.sampling_coordinates)
-
-        #Build a domain for the image table
-        image_domain = []
-        print(f"Scene shape is {scene.shape}")
-        for y in range(scene.shape[1]):
-            image_domain.append(ContinuousVariable(f"{y}"))
-        domain = Domain(image_domain)
-        tableB = Table.from_numpy(domain, np.squeeze(scene))
+        hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
+        gui.spin(
+            hb, self, "cache_size", 0, 65536, step=64,
+            label="Frame cache (MB):", callback=self.cache_size_changed,
+            tooltip="Memory used to keep decoded frames for quick re-selection")
+        gui.checkBox(
+            hb, self, "read_ahead", "Read ahead neighbouring frames",
+            tooltip="Decode the previous and next frames in the background")
+        gui.checkBox(
+            hb, self, "memmap_spectra", "Memory-map spectra",
+            callback=self.reload,
+            tooltip="Keep the spectra of large frames in a file-backed memory map instead of RAM")
+        gui.comboBox(
+            hb, self, "preview_level", label="Preview:",
+            items=("Full size", "1/2", "1/4", "1/8"), callback=self.reload,
+            tooltip="Downscale the preview image, averaging blocks of pixels")
+        gui.rubber(hb)
+
+        hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
+        gui.checkBox(
+            hb, self, "stack", "Combine frames", callback=self.reload,
+            tooltip="Output the spectra of a range of frames as one table: stacked, "
+                    "with the frame number and timestamp of each row, or a statistic "
+                    "of each sample over the frames")
+        gui.comboBox(
+            hb, self, "combine", items=[label for label, _ in self.COMBINE],
+            callback=self.stack_changed,
+            tooltip="Statistics are computed frame by frame, in little memory; "
+                    "the median is an estimate")
+        gui.spin(
+            hb, self, "stack_first", 0, 1000000, label="from",
+            callback=self.stack_changed, controlWidth=80)
+        last = gui.spin(
+            hb, self, "stack_last", -1, 1000000, label="to",
+            callback=self.stack_changed, controlWidth=80)
+        last.setSpecialValueText("last")
+        gui.spin(
+            hb, self, "stack_step", 1, 1000000, label="step",
+            callback=self.stack_changed, controlWidth=60)
+        gui.rubber(hb)
+
+        hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
+        edit = gui.lineEdit(
+            hb, self, "wavelength_ranges", label="Wavelengths (nm):",
+            callback=self.reload, controlWidth=200,
+            tooltip="Keep only these wavelength ranges, e.g. 450-700; 780-900")
+        edit.setPlaceholderText("all")
+        gui.spin(
+            hb, self, "band_binning", 1, 64, label="Average bands in groups of",
+            callback=self.reload, controlWidth=50,
+            tooltip="Average adjacent bands, for smaller tables at a coarser resolution")
+        gui.rubber(hb)
+
+        hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
+        edit = gui.lineEdit(
+            hb, self, "sample_area", label="Samples in area:",
+            callback=self.reload, controlWidth=200,
+            tooltip="Keep only samples within map_x, map_y from x0, y0 to x1, y1")
+        edit.setPlaceholderText("all, or x0, y0, x1, y1")
+        gui.spin(
+            hb, self, "sample_stride", 1, 1000, label="every",
+            callback=self.reload, controlWidth=50,
+            tooltip="Keep every n-th sample")
+        gui.spin(
+            hb, self, "sample_percent", 1, 100, label="random %",
+            callback=self.reload, controlWidth=50,
+            tooltip="Keep a random subset of the samples; the same samples in every frame")
+        gui.rubber(hb)
+
+        hb = gui.widgetBox(self.mainArea, orientation=Qt.Horizontal)
+        gui.checkBox(
+            hb, self, "watch", "Watch folder", callback=self.watch_changed,
+            tooltip="Follow the newest .lo file in a folder, outputting new frames as they are written")
+        gui.button(hb, self, "Choose...", callback=self.browse_watch_folder, autoDefault=False)
+        self.watch_label = gui.widgetLabel(hb, "")
+        gui.spin(
+            hb, self, "watch_interval", 1, 3600, label="check every (s)",
+            callback=self.watch_interval_changed, controlWidth=50)
+        gui.spin(
+            hb, self, "watch_window", 1, 1000, label="output last",
+            callback=self.reload, controlWidth=50,
+            tooltip="Number of newest frames in the output, stacked if more than one")
+        gui.widgetLabel(hb, "frames")
+        gui.rubber(hb)
+
+    def stack_changed(self):
+        if self.stack:
+            self.reload()
+
+    def cache_size_changed(self):
+        self.frame_cache.resize(self.cache_size * 2 ** 20)
+
+    @staticmethod
+    def create_tables_from_results(results, memmap=False, preview_scale=1, reduction=None,
+                                   selection=None):
+        if not results: return
+        (metadata, scene, spectra) = results
+        # Unless reduced, the Spectra table shares the SDK's float32 buffer; see orangecontrib.lo.io.tables
+        tableA = spectra_table(metadata, spectra, memmap=memmap,
+                               reduction=reduction, selection=selection)
+        tableB = preview_table(scene, preview_scale)
         return tableA, tableB
 
+    def reduction_and_selection(self):
+        """The band reduction and sample selection to apply, or None, None if invalid"""
+        self.Error.invalid_ranges.clear()
+        self.Error.invalid_area.clear()
+        try:
+            reduction = BandReduction(parse_windows(self.wavelength_ranges) or None,
+                                      self.band_binning)
+        except ValueError as ex:
+            self.Error.invalid_ranges(str(ex))
+            return None, None
+        try:
+            selection = SampleSelection(parse_box(self.sample_area), self.sample_stride,
+                                        self.sample_percent / 100)
+        except ValueError as ex:
+            self.Error.invalid_area(str(ex))
+            return None, None
+        return reduction, selection
+
     def reload(self):
         if not self.lofile: return
-        self.load_lo_file()
-        if self.results: 
-            tableA, tableB = self.create_tables_from_results()
-            self.Outputs.spectral_data.send(tableA)
-            self.Outputs.preview_data.send(tableB)
+        self.Error.load_exception.clear()
+        if self.watch and self.watch_folder:
+            self.follow(restart=True)
+            return
+        reduction, selection = self.reduction_and_selection()
+        if reduction is None:
+            return
+        # Starting a new task cancels the one in progress, so a stale frame is never sent
+        stack = None
+        if self.stack:
+            stop = None if self.stack_last < 0 else self.stack_last + 1
+            stack = slice(self.stack_first, stop, self.stack_step)
+        self.start(load_lo_file, self.lofile, self.sheet,
+                   self.frame_cache, self.read_ahead, self.memmap_spectra,
+                   stack=stack, preview_scale=2 ** self.preview_level,
+                   statistic=self.COMBINE[self.combine][1], pool=self.decoding_pool,
+                   reduction=None if reduction.is_identity else reduction,
+                   selection=None if selection.is_identity else selection)
+
+    def follow(self, restart=False):
+        """Output the newest frames of the watched file.
+
+        The frames are kept between calls, so only new frames are read; with
+        `restart` (e.g. after the options changed), they are read anew.
+        """
+        reduction, selection = self.reduction_and_selection()
+        if reduction is None:
+            return
+        if restart or self.frame_window is None:
+            # A window still being updated by a cancelled task is left to it
+            self.frame_window = FrameWindow(
+                self.watch_window, self.frame_cache,
+                None if reduction.is_identity else reduction,
+                None if selection.is_identity else selection)
+        self.start(follow_lo_file, self.lofile, self.frame_window, self.memmap_spectra,
+                   preview_scale=2 ** self.preview_level)
+
+    def poll_folder(self):
+        """Switch to the newest file in the watched folder and follow it if it changed"""
+        if not (self.watch and self.watch_folder) or self.task is not None:
+            return  # off, or still busy with the previous update
+        newest = newest_file(self.watch_folder)
+        if newest is None:
+            return
+        if newest != self.lofile:
+            if newest in self.recentFiles:
+                self.recentFiles.remove(newest)
+            self.recentFiles.insert(0, newest)
+            self.file_index = 0
+            self.lofile = newest
+            self.refresh_sheet_list = True
+            self.populate_comboboxes()
+        try:
+            stat = os.stat(newest)
+        except OSError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp != self.watch_stamp:
+            self.watch_stamp = stamp
+            self.follow()
+
+    def watch_changed(self):
+        self.sheetcombo.setEnabled(not self.watch)
+        self.watch_label.setText(path.basename(self.watch_folder) or "(no folder)")
+        self.Warning.follow_failed.clear()
+        self.frame_window = None
+        self.watch_stamp = None
+        if self.watch and self.watch_folder:
+            self.watch_timer.start()
+            self.poll_folder()
+        else:
+            self.watch_timer.stop()
+
+    def watch_interval_changed(self):
+        self.watch_timer.setInterval(1000 * self.watch_interval)
+
+    def browse_watch_folder(self):
+        folder = QFileDialog.getExistingDirectory(
+            self, "Folder to watch for Living Optics files", self.watch_folder or ".")
+        if folder:
+            self.watch_folder = folder
+            self.watch = True
+            self.watch_changed()
+
+    def on_done(self, results: Optional[Results]):
+        self.Warning.follow_failed.clear()
+        if results is None:
+            return # Nothing new in the watched file
+        if results.sheets != self.sheets:
+            self.refresh_sheet_list = True # A new file, so refresh the frames drop-down combobox
+        self.sheets = results.sheets
+        self.results = results.frame
+        self.populate_comboboxes()
+        self.sheet = results.sheet
+        self.Outputs.spectral_data.send(results.spectra)
+        self.Outputs.preview_data.send(results.preview)
+
+    def on_exception(self, ex: Exception):
+        if self.watch and self.watch_folder:
+            # e.g. a frame still being written; keep the last frames and try
+            # again on the next check, so that views downstream don't blank
+            self.watch_stamp = None
+            self.Warning.follow_failed(ex)
+            return
+        self.results = None
+        self.Error.load_exception(ex)
+        self.Outputs.spectral_data.send(None)
+        self.Outputs.preview_data.send(None)
+
+    def on_partial_result(self, _):
+        pass
+
+    def onDeleteWidget(self):
+        self.watch_timer.stop()
+        self.shutdown()
+        self.frame_cache.shutdown()
+        self.decoding_pool.shutdown()
+        super().onDeleteWidget()
         
     def browse_lo_file(self, browse_demos=False):
         """user pressed the '...' button to manually select a file to load"""
@@ -167,7 +495,7 @@ class OWLOFileReader(OWWidget):
 
     def select_sheet(self):
         #elf.sheet = sheet
-        print(f"Frame {self.sheet} is now selected")
+        logger.debug("Frame %s is now selected", self.sheet)
         self.reload()
 
     def populate_comboboxes(self):
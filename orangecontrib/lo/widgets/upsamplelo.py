@@ -1,11 +1,21 @@
-from Orange.data import Table
+from Orange.data import Table, Domain, ContinuousVariable
 from Orange.widgets import gui
 from Orange.widgets.settings import Setting
 from Orange.widgets.widget import OWWidget, Input, Output, Msg
 
-from lo.sdk.api.acquisition.data.coordinates import NearestUpSample
+from orangecontrib.lo.compute.upsample import (
+    UPSAMPLERS, pixel_coordinates, roi_bounds, upsample_frame, upsample_tiled)
+from orangecontrib.lo.io.tables import lo_domain, table_from_arrays
+from orangecontrib.lo.instrument import logger
 import numpy as np
 
+
+def sampling_coordinates(data: Table) -> np.ndarray:
+    """The (samples x 2) map_x, map_y coordinates of LO spectra"""
+    if "map_x" in data.domain and "map_y" in data.domain:
+        return np.column_stack((data.get_column("map_x"), data.get_column("map_y"))).astype(float)
+    return data.metas[:, :2].astype(float) #since that's the coordinates in the LO data
+
 class UpsampleLO(OWWidget):
     # Widget needs a name, or it is considered an abstract widget
     # and not shown in the menu.
@@ -27,16 +37,44 @@ class UpsampleLO(OWWidget):
         # if there are two or more outputs, default=True marks the default output
         out_data = Output("Data", Table, default=True)
         originals = Output("Sparse Data", Table)
+        pixel_map = Output("Pixel Map", Table)
     
     upsample_dimension = Setting("640")
+    method = Setting("Nearest")
+    # Size of the full field of view at scale 1, and where it starts in sample coordinates
+    full_size = Setting(1920)
+    origin_x = Setting(64)
+    origin_y = Setting(256)
+    # The dense table repeats a spectrum for every pixel; without it, the
+    # Pixel Map and Sparse Data outputs describe the same image far more compactly.
+    output_dense = Setting(True)
+    # Region of the output to compute, in output pixels
+    use_roi = Setting(False)
+    roi_top = Setting(0)
+    roi_left = Setting(0)
+    roi_height = Setting(480)
+    roi_width = Setting(480)
+    # Tiles bound the memory used besides the output, for large outputs and slow methods
+    tiled = Setting(False)
+    tile_size = Setting(256)
+
+    # The pixel map's column of sample numbers; one variable, so its domain is shared
+    SAMPLE = ContinuousVariable("sample", number_of_decimals=0)
   
     # same class can be initiated for Error and Information messages
     class Warning(OWWidget.Warning):
         warning = Msg("My warning!")
 
+    class Error(OWWidget.Error):
+        roi_outside = Msg("Region of interest lies outside the output image")
+
     def __init__(self):
         super().__init__()
         self.data = None
+        self.in_data = None
+        self.upsampled = None
+        self.out_data = None
+        self.out_pixel_map = None
         
         self.label_box = gui.comboBox(
             self.controlArea, 
@@ -47,64 +85,149 @@ class UpsampleLO(OWWidget):
             sendSelectedValue=True,
             callback=self.changeSetting
         )
+        gui.comboBox(
+            self.controlArea,
+            self,
+            "method",
+            label="Interpolation",
+            items=tuple(UPSAMPLERS),
+            sendSelectedValue=True,
+            callback=self.changeSetting
+        )
+        box = gui.hBox(self.controlArea, "Field of view")
+        gui.spin(box, self, "origin_x", -10000, 10000, label="Origin:",
+                 callback=self.changeSetting, controlWidth=60)
+        gui.spin(box, self, "origin_y", -10000, 10000,
+                 callback=self.changeSetting, controlWidth=60)
+        gui.spin(box, self, "full_size", 1, 10000, label="Size:",
+                 callback=self.changeSetting, controlWidth=60)
+        gui.checkBox(
+            self.controlArea,
+            self,
+            "output_dense",
+            "Output dense spectra for every pixel",
+            callback=self.expand_changed,
+            tooltip="Otherwise, with nearest interpolation, each pixel's spectrum "
+                    "is the Sparse Data row given in Pixel Map"
+        )
+        box = gui.vBox(self.controlArea, "Region of interest")
+        gui.checkBox(box, self, "use_roi", "Upsample only a region",
+                     callback=self.changeSetting)
+        row = gui.hBox(box)
+        gui.spin(row, self, "roi_top", 0, 10000, label="Top:",
+                 callback=self.changeSetting, controlWidth=60)
+        gui.spin(row, self, "roi_left", 0, 10000, label="Left:",
+                 callback=self.changeSetting, controlWidth=60)
+        row = gui.hBox(box)
+        gui.spin(row, self, "roi_height", 1, 10000, label="Height:",
+                 callback=self.changeSetting, controlWidth=60)
+        gui.spin(row, self, "roi_width", 1, 10000, label="Width:",
+                 callback=self.changeSetting, controlWidth=60)
+        row = gui.hBox(box)
+        gui.checkBox(row, self, "tiled", "Work in tiles of",
+                     callback=self.changeSetting,
+                     tooltip="Build only the dense spectra, a tile at a time; "
+                             "uses less memory, but provides no Pixel Map")
+        gui.spin(row, self, "tile_size", 16, 4096, step=16,
+                 callback=self.changeSetting, controlWidth=60)
     
 
     @Inputs.in_data
     def set_data(self, in_data):
+        self.Error.clear()
         if in_data is not None: #This is where the data processing happens?
 
             self.originals = in_data # Pass through the unmolested data
             self.in_data = in_data
 
-            print(f"Refreshing data: Shape of data is now: {np.shape(self.in_data)}")
-            # extract the sampling_coordinates from the metadata on self.data
-            sampling_coordinates = in_data.metas #since that's the coordinates in the LO data, unless we go and mess that up somewhere else. 
             upsample_dimension = int(self.upsample_dimension)
-            sampling_scale = upsample_dimension/1920 #Maximum size is 1920, hard coded.
-            print(f"Upsample to {upsample_dimension}, using scale {sampling_scale}")
-
-            upsampler = NearestUpSample(
-                sampling_coordinates, 
-                output_shape=(upsample_dimension, upsample_dimension), 
-                origin=(64, 256), 
-                scale = sampling_scale
-            )
-            upsampled_cube = upsampler(in_data.X)
-            print(f"upsampled_cube shape is {upsampled_cube.shape}")
-
-            #convert the upsampled cube into a table.             
-            domain = in_data.domain 
-            
-            # Need to reshape the x,y,λ data into (loc, λ) where loc is the sampled coords
-            # Do the sample coordinates first. Need to use 'ij' indexing style since
-            # meshgrid makes an NxM matrix from np.meshgrid(M,N) because python. 
-            # If you allow the default (xy indexing), any mismatch in array dimensions (i.e. if it's non-square) 
-            # causes the output to be all skewed.
-            x,y = np.meshgrid(np.arange(upsampled_cube.shape[0]),np.arange(upsampled_cube.shape[1]), indexing='ij')
-            x = x.reshape(-1)
-            y = y.reshape(-1)
-            #Need to get x,y into the right format, which is stuck together and then transposed
-            coordinates = np.array([x,y]).T 
-            print(f"coordinate array shape {coordinates.shape}")
-            #Then do the cube
-            reshaped_cube = upsampled_cube.reshape(-1,upsampled_cube.shape[2])
-            self.out_data = Table.from_numpy(domain, reshaped_cube, metas=coordinates)  
-            
-            print(f"Shape of data is now: {np.shape(self.out_data)}")
+            sampling_scale = upsample_dimension/self.full_size
+            logger.debug("Upsampling %s to %s, using scale %s",
+                         in_data.X.shape, upsample_dimension, sampling_scale)
+
+            output_shape = (upsample_dimension, upsample_dimension)
+            roi = None
+            if self.use_roi:
+                roi = (self.roi_top, self.roi_left,
+                       self.roi_top + self.roi_height, self.roi_left + self.roi_width)
+            try:
+                roi = roi_bounds(output_shape, roi)
+            except ValueError:
+                self.Error.roi_outside()
+                self.upsampled = self.out_data = self.out_pixel_map = None
+            else:
+                if self.tiled:
+                    self.upsampled = None
+                    self.out_pixel_map = None
+                    self.out_data = self.tiled_table(output_shape, sampling_scale, roi) \
+                        if self.output_dense else None
+                else:
+                    self.upsampled = upsample_frame(
+                        in_data.X,
+                        sampling_coordinates(in_data),
+                        output_shape=output_shape,
+                        origin=(self.origin_x, self.origin_y),
+                        scale = sampling_scale,
+                        method=self.method,
+                        roi=roi
+                    )
+                    self.out_pixel_map = self.pixel_map_table()
+                    self.out_data = self.dense_table() if self.output_dense else None
             
         else:
+            self.upsampled = None
             self.out_data = None
+            self.out_pixel_map = None
 
         self.Outputs.out_data.send(self.out_data)
         self.Outputs.originals.send(self.originals)
+        self.Outputs.pixel_map.send(self.out_pixel_map)
+
+    def dense_table(self):
+        # Rows are pixels in row-major order, with the pixel coordinates as map_x, map_y.
+        # The spectra are gathered straight from the sparse data, with no intermediate cube.
+        domain = lo_domain(self.in_data.domain.attributes)
+        return table_from_arrays(
+            domain, self.upsampled.expand(),
+            metas=self.upsampled.pixel_coordinates())
+
+    def tiled_table(self, output_shape, scale, roi):
+        # The dense spectra are written tile by tile into the table's X
+        X = upsample_tiled(
+            self.in_data.X, sampling_coordinates(self.in_data),
+            output_shape=output_shape, origin=(self.origin_x, self.origin_y),
+            scale=scale, method=self.method, roi=roi, tile_size=self.tile_size)
+        domain = lo_domain(self.in_data.domain.attributes)
+        return table_from_arrays(domain, X, metas=pixel_coordinates(roi))
+
+    def pixel_map_table(self):
+        # One row per pixel: its coordinates and the row of Sparse Data it shows.
+        # These are attributes rather than metas, since Orange boxes every meta value.
+        if self.upsampled.index is None:
+            return None # Interpolated pixels mix several samples
+        domain = lo_domain(["map_x", "map_y", self.SAMPLE], metas=())
+        X = np.empty((len(self.upsampled), 3), dtype=np.float32)
+        X[:, :2] = self.upsampled.pixel_coordinates(dtype=np.float32)
+        X[:, 2] = self.upsampled.index.reshape(-1)
+        return table_from_arrays(domain, X)
+
     def changeSetting(self):
         self.set_data(self.in_data)
 
+    def expand_changed(self):
+        if self.tiled:
+            self.changeSetting()
+            return
+        # The pixel map is unchanged, so only the dense table needs (re)building
+        self.out_data = self.dense_table() if self.output_dense and self.upsampled is not None else None
+        self.Outputs.out_data.send(self.out_data)
+
     def commit(self):
         #Update the contents, using the data that were originally passed in to make sure we don't keep making it smaller. 
                 
         self.Outputs.out_data.send(self.out_data)
         self.Outputs.originals.send(self.originals)
+        self.Outputs.pixel_map.send(self.out_pixel_map)
     
     def send_report(self):
         # self.report_plot() includes visualizations in the report
@@ -43,6 +43,8 @@ ENTRY_POINTS = {
         ('Orange3-LivingOptics = orangecontrib.lo',),
     'orange.widgets':
         ('LivingOptics = orangecontrib.lo.widgets',),
+    'console_scripts':
+        ('lo-convert = orangecontrib.lo.io.convert:main',),
 #     # Register widget help
 #     "orange.canvas.help": (
 #         'html-index = orangecontrib.wfdb.widgets:WIDGET_HELP_PATH',)